@@ -423,8 +423,8 @@ def deploy(parent_args: list = None):
 
 
 def parse_controller_args(args: dict):
-    if args.get('list'):
-        return KVMController().list_vms()
+    if args.get('list') or args.get('detail'):
+        return KVMController().list_vms(args.get('detail', False))
     if args.get('networks'):
         return network(args.get('vm', ''), args['networks'])
     if args.get('hardware'):
@@ -469,6 +469,11 @@ def controller(parent_args: list = None):
             'action': 'store_true',
             'help': 'List virtual machines'
         },
+        'detail': {
+            'short': 'ld',
+            'action': 'store_true',
+            'help': 'List virtual machines with their state, disks and interfaces'
+        },
         'reboot': {
             'short': 'R',
             'help': 'Reboot virtual machine',
@@ -698,6 +703,13 @@ def parse_remote_deploy_args(args: dict):
         if args.get('build'):
             build_args = args.pop('build')
             return gcp_builder(args, build_args)
+        if args['count'] > 1:
+            return GCPDeploy.deploy_many([{
+                'name': args['name'] if args['name'] == 'GENERATE' else f'{args["name"]}-{index}',
+                'image': args['image'], 'image_project': args['imageProject'], 'disk_size': args['diskSize'],
+                'disk_type': args['diskType'], 'project_id': args['projectID'], 'zone': args['zone'],
+                'machine_type': args['machineType'], 'network_tags': args['networkTags']
+            } for index in range(1, args['count'] + 1)])
         return GCPDeploy(args['name'], args['image'], args['imageProject'], args['diskSize'], args['diskType'],
                          args['projectID'], args['zone'], args['machineType'], args['networkTags']).deploy()
     if args.get('build'):
@@ -755,6 +767,12 @@ def remote_deploy(parent_args: list = None):
             'nargs': '+',
             'default': ['ssh']
         },
+        'count': {
+            'short': 'c',
+            'help': 'Number of VMs to deploy concurrently. Names are suffixed with -<index> when set. Default: 1',
+            'type': int,
+            'default': 1
+        },
         'build': {
             'short': 'b',
             'help': 'Build GCP image',
@@ -832,7 +850,7 @@ def remote_controller(parent_args: list = None):
         },
         'zone': {
             'short': 'z',
-            'help': 'GCP zone. Default: us-central1-a',
+            'help': 'GCP zone. Use "all" with --list to list instances in every zone. Default: us-central1-a',
             'default': 'us-central1-a'
         },
         'delete': {
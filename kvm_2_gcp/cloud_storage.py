@@ -1,7 +1,13 @@
 import json
+from base64 import b64encode
 from logging import Logger
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
 
+import google_crc32c
+from requests.adapters import HTTPAdapter
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
 from google.api_core.exceptions import NotFound
 
 from kvm_2_gcp.utils import Utils
@@ -20,7 +26,6 @@ class GCPCloudStorage(Utils):
         """
         super().__init__(service_account, logger=logger)
         self.__bucket = bucket
-        self.__client: storage.Client | None = None
         if set_used_bucket and bucket != 'default':
             self._add_bucket_to_used_buckets(bucket)
 
@@ -42,12 +47,24 @@ class GCPCloudStorage(Utils):
         Returns:
             storage.Client | None: storage manager client object or None on failure
         """
-        if self.__client is None:
-            try:
-                self.__client = storage.Client(credentials=self.creds)
-            except Exception:
-                self.log.exception('Failed to load cloud storage client')
-        return self.__client
+        try:
+            return self._get_client(storage.Client, self.__mount_http_adapter)
+        except Exception:
+            self.log.exception('Failed to load cloud storage client')
+        return None
+
+    @staticmethod
+    def __mount_http_adapter(client: storage.Client, pool_size: int = 128):
+        """Mount an HTTP adapter with a connection pool sized for concurrent chunk uploads. The
+        default pool keeps 10 connections and discards the rest
+
+        Args:
+            client (storage.Client): storage client to mount the adapter on
+            pool_size (int, optional): max connections to keep per host. Defaults to 128.
+        """
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        client._http.mount('https://', adapter)
+        client._http._auth_request.session.mount('https://', adapter)
 
     def __get_default_bucket(self) -> str:
         """Get the default bucket name
@@ -117,14 +134,18 @@ class GCPCloudStorage(Utils):
             self.log.exception('Failed to add bucket to used buckets')
         return False
 
-    def upload_from_file(self, file_path: str, bucket_path: str,
-                         content_type: str = 'application/octet-stream') -> bool:
-        """Upload file to bucket from file path
+    def upload_from_file(self, file_path: str, bucket_path: str, content_type: str = 'application/octet-stream',
+                         chunk_size: int = 33554432, max_workers: int = 16) -> bool:
+        """Upload file to bucket from file path. Files larger than the chunk size are uploaded in concurrent chunks
+        using the XML multipart upload API. Uploads are verified with CRC32C which uses the hardware accelerated
+        google-crc32c extension instead of hashing MD5 in Python
 
         Args:
             file_path (str): file path to upload
             bucket_path (str): the path to save the file in the bucket
             content_type (str, optional): the content type tag. Defaults to 'application/octet-stream'.
+            chunk_size (int, optional): size of each concurrently uploaded chunk. Defaults to 33554432 (32MB).
+            max_workers (int, optional): max concurrent chunk uploads. Defaults to 16.
 
         Returns:
             bool: True if successful, False otherwise
@@ -132,7 +153,12 @@ class GCPCloudStorage(Utils):
         blob = self.get_blob(bucket_path)
         if blob:
             try:
-                blob.upload_from_filename(file_path, content_type=content_type)
+                if Path(file_path).stat().st_size > chunk_size:
+                    transfer_manager.upload_chunks_concurrently(
+                        str(file_path), blob, content_type=content_type, chunk_size=chunk_size,
+                        worker_type=transfer_manager.THREAD, max_workers=max_workers, checksum='crc32c')
+                else:
+                    blob.upload_from_filename(file_path, content_type=content_type, checksum='crc32c')
                 self.log.info(f'Successfully uploaded file {file_path} to {bucket_path}')
                 return True
             except Exception:
@@ -141,6 +167,32 @@ class GCPCloudStorage(Utils):
             self.log.error(f'Failed to upload file {file_path} to {bucket_path}')
         return False
 
+    def needs_upload(self, file_path: str, bucket_path: str) -> bool:
+        """Check if a file needs to be uploaded by comparing the local file CRC32C checksum with the bucket object
+
+        Args:
+            file_path (str): local file path
+            bucket_path (str): the path to the file in the bucket
+
+        Returns:
+            bool: False if the bucket object exists with a matching checksum, True otherwise
+        """
+        try:
+            blob = self.client.get_bucket(self.bucket).get_blob(bucket_path)
+            if blob is None or not blob.crc32c:
+                return True
+            checksum = google_crc32c.Checksum()
+            with open(file_path, 'rb') as file:
+                if Path(file_path).stat().st_size:
+                    with mmap(file.fileno(), 0, access=ACCESS_READ) as data:
+                        checksum.update(data)
+            if b64encode(checksum.digest()).decode() == blob.crc32c:
+                self.log.info(f'Object {bucket_path} already exists with matching checksum')
+                return False
+        except Exception:
+            self.log.exception(f'Failed to compare checksum for {bucket_path}')
+        return True
+
     def get_blob(self, blob_path: str) -> storage.Blob | None:
         """Get blob object from bucket
 
@@ -1,5 +1,4 @@
-from datetime import datetime
-from pathlib import Path
+from time import strftime
 from logging import Logger
 
 from kvm_2_gcp.gcp_deploy import GCPDeploy
@@ -27,7 +26,7 @@ class GCPBuilder(GCPDeploy):
             family (str, optional): image family tag name to set for the created image. Defaults to 'k2g-images'.
             logger (Logger, optional): logger object to use. Defaults to None.
         """
-        name = name if name != 'GENERATE' else f'build-{datetime.now().strftime("%Y-%m-%d--%H-%M-%S")}'
+        name = name if name != 'GENERATE' else f'build-{strftime("%Y-%m-%d--%H-%M-%S")}'
         if playbook:
             playbook = f'builds/{playbook}'
         super().__init__(name, image, image_project, disk_size, disk_type, project_id, zone, machine_type,
@@ -49,11 +48,8 @@ class GCPBuilder(GCPDeploy):
         Returns:
             bool: True if the build options were displayed successfully, False otherwise
         """
-        builds = []
-        for content in Path(self.__build_dir).glob('*.yml'):
-            builds.append(content.name)
-        builds.sort()
-        return self.display_info_msg(f'Available builds:\n  {"\n  ".join(builds)}')
+        builds = '\n  '.join(self._get_playbooks(self.__build_dir))
+        return self.display_info_msg(f'Available builds:\n  {builds}')
 
     def __run_build_playbook(self, ip: str = None) -> bool:
         """Run the build playbook on the VM
@@ -1,14 +1,59 @@
+from collections.abc import Iterator
+from dataclasses import dataclass
+from functools import cached_property
 from logging import Logger
-from time import sleep
+from random import uniform
+from typing import Any, Callable
+from uuid import uuid4
 from json import dumps
+from time import monotonic, sleep
 
 from google.cloud import compute_v1
-from google.api_core.operation import Operation
-from google.api_core.exceptions import BadRequest
+from google.api_core.extended_operation import ExtendedOperation
+from google.api_core.exceptions import (
+    BadRequest, GoogleAPICallError, InternalServerError, ServiceUnavailable, TooManyRequests
+)
 
 from kvm_2_gcp.utils import Utils
 
 
+@dataclass(frozen=True)
+class PollSettings:
+    """Backoff settings used when polling GCP operations
+
+    Attributes:
+        initial (float): delay in seconds before the second poll. Defaults to 0.1.
+        multiplier (float): growth factor applied to the delay after each poll. Defaults to 1.3.
+        max_delay (float): max delay in seconds between polls. Defaults to 10.
+        total_timeout (float): max seconds to wait for an operation before giving up. Defaults to 600 (10 mins).
+    """
+    initial: float = 0.1
+    multiplier: float = 1.3
+    max_delay: float = 10.0
+    total_timeout: float = 600.0
+
+
+@dataclass(frozen=True)
+class RetrySettings:
+    """Backoff settings used when retrying transient GCP API errors
+
+    Attributes:
+        retries (int): max retries after the first attempt. Defaults to 5.
+        base (float): base delay in seconds used for the first retry. Defaults to 0.25.
+        cap (float): max delay in seconds between retries. Defaults to 10.
+    """
+    retries: int = 5
+    base: float = 0.25
+    cap: float = 10.0
+
+
+RETRY_ON = (InternalServerError, ServiceUnavailable, TooManyRequests)
+RUNNING_STATUSES = frozenset({'RUNNING'})
+STOPPED_STATUSES = frozenset({'TERMINATED', 'STOPPED', 'STOPPING'})
+INSTANCE_LIST_FIELD_MASK = ('x-goog-fieldmask', 'items(name,status),nextPageToken')
+AGGREGATED_LIST_FIELD_MASK = ('x-goog-fieldmask', 'items.*.instances(name,status),nextPageToken')
+
+
 class GCPController(Utils):
     def __init__(self, logger: Logger = None):
         """A module that helps control GCP instances. It provides methods to create, delete, start, stop, and reboot
@@ -18,10 +63,8 @@ class GCPController(Utils):
             logger (Logger, optional): logger to use. Defaults to None.
         """
         super().__init__(logger=logger)
-        self.__client: compute_v1.InstancesClient | None = None
-        self.__image_client: compute_v1.ImagesClient | None = None
-        self.__zone_op_client: compute_v1.ZoneOperationsClient | None = None
-        self.__global_op_client: compute_v1.GlobalOperationsClient | None = None
+        self.poll_settings = PollSettings()
+        self.retry_settings = RetrySettings()
 
     @property
     def client(self) -> compute_v1.InstancesClient | None:
@@ -30,12 +73,11 @@ class GCPController(Utils):
         Returns:
             compute_v1.InstancesClient | None: GCP instance client
         """
-        if self.__client is None:
-            try:
-                self.__client = compute_v1.InstancesClient(credentials=self.creds)
-            except Exception:
-                self.log.exception('Failed to create GCP compute client')
-        return self.__client
+        try:
+            return self._get_client(compute_v1.InstancesClient)
+        except Exception:
+            self.log.exception('Failed to create GCP compute client')
+        return None
 
     @property
     def image_client(self) -> compute_v1.ImagesClient | None:
@@ -44,89 +86,161 @@ class GCPController(Utils):
         Returns:
             compute_v1.ImagesClient | None: GCP image client
         """
-        if self.__image_client is None:
-            try:
-                self.__image_client = compute_v1.ImagesClient(credentials=self.creds)
-            except Exception:
-                self.log.exception('Failed to create GCP image client')
-        return self.__image_client
+        try:
+            return self._get_client(compute_v1.ImagesClient)
+        except Exception:
+            self.log.exception('Failed to create GCP image client')
+        return None
 
     @property
     def zone_op_client(self) -> compute_v1.ZoneOperationsClient | None:
-        """Zone operations client object with credentials set
+        """Zone operation client object with credentials set
 
         Returns:
-            compute_v1.ZoneOperationsClient | None: GCP zone operations client
+            compute_v1.ZoneOperationsClient | None: GCP zone operation client
         """
-        if self.__zone_op_client is None:
-            try:
-                self.__zone_op_client = compute_v1.ZoneOperationsClient(credentials=self.creds)
-            except Exception:
-                self.log.exception('Failed to create GCP zonal operation client')
-        return self.__zone_op_client
+        try:
+            return self._get_client(compute_v1.ZoneOperationsClient)
+        except Exception:
+            self.log.exception('Failed to create GCP zone operation client')
+        return None
 
     @property
     def global_op_client(self) -> compute_v1.GlobalOperationsClient | None:
-        """Global operations client object with credentials set
+        """Global operation client object with credentials set
+
+        Returns:
+            compute_v1.GlobalOperationsClient | None: GCP global operation client
+        """
+        try:
+            return self._get_client(compute_v1.GlobalOperationsClient)
+        except Exception:
+            self.log.exception('Failed to create GCP global operation client')
+        return None
+
+    @cached_property
+    def _default_project_id(self) -> str:
+        """Default project ID loaded once per controller
+
+        Returns:
+            str: default project ID or empty string on failure
+        """
+        return self._load_default_project_id()
+
+    def _resolve_project_id(self, project_id: str) -> str:
+        """Resolve the project ID, replacing 'default' with the default project ID
+
+        Args:
+            project_id (str): project ID or 'default'
+
+        Returns:
+            str: resolved project ID
+        """
+        return self._default_project_id if project_id == 'default' else project_id
+
+    def _retry(self, func: Callable, *args, **kwargs) -> Any:
+        """Call a GCP API method and retry transient errors with full jitter backoff so concurrent callers spread out
+        their retries
+
+        Args:
+            func (Callable): API method to call
+            *args: positional arguments for the method
+            **kwargs: keyword arguments for the method
 
         Returns:
-            compute_v1.GlobalOperationsClient | None: GCP global operations client
+            Any: the method result
         """
-        if self.__global_op_client is None:
+        settings = self.retry_settings
+        for attempt in range(settings.retries + 1):
             try:
-                self.__global_op_client = compute_v1.GlobalOperationsClient(credentials=self.creds)
-            except Exception:
-                self.log.exception('Failed to create GCP global operation client')
-        return self.__global_op_client
+                return func(*args, **kwargs)
+            except RETRY_ON as error:
+                if attempt == settings.retries:
+                    raise
+                delay = uniform(0, min(settings.cap, settings.base * 2 ** attempt))
+                self.log.debug(f'Retrying {func.__name__} in {delay:.2f} seconds after error: {error.message}')
+                sleep(delay)
+
+    def _poll_delay(self, attempt: int) -> float:
+        """Get the delay to sleep before the next operation poll. The delay grows exponentially with each attempt up
+        to the max delay and has jitter applied so concurrent callers do not poll in lockstep.
 
-    def _wait_for_zone_operation(self, operation: Operation, zone: str) -> bool:
-        """Wait for zone operation to finish and check for errors
+        Args:
+            attempt (int): the number of polls already performed
+
+        Returns:
+            float: seconds to sleep before the next poll
+        """
+        settings = self.poll_settings
+        return min(settings.max_delay, settings.initial * settings.multiplier ** attempt) * uniform(0.5, 1.5)
+
+    @staticmethod
+    def __operation_location(operation: ExtendedOperation) -> tuple[str, str]:
+        """Get the project and zone of an operation from its self link. Global operations have no zone
 
         Args:
-            operation (Operation): operation to wait for
-            zone (str): zone to check for operation
+            operation (ExtendedOperation): operation to get the location of
 
         Returns:
-            bool: True if operation finished successfully, False otherwise
+            tuple[str, str]: project ID and zone, zone is an empty string for global operations
         """
-        while True:
-            result = self.get_zone_operation(self.project_id, zone, operation.name)
-            if result:
-                if result.status == compute_v1.Operation.Status.DONE:
-                    if result.error:
-                        self.log.error(f'Operation {operation.name} finished with error: {result.error}')
-                        return False
-                    self.display_success_msg(f'Operation {operation.name} completed successfully')
-                    return True
-                self.display_info_msg(f'Waiting for operation {operation.name} to complete...')
-            else:
-                self.log.error(f'Failed to get operation {operation.name}')
-                return False
-            sleep(3)
+        parts = operation.self_link.split('/')
+        project_id = parts[parts.index('projects') + 1]
+        zone = parts[parts.index('zones') + 1] if 'zones' in parts else ''
+        return project_id, zone
+
+    def __wait_rpc(self, project_id: str, zone: str, name: str) -> compute_v1.Operation:
+        """Call the operation wait RPC. The RPC returns when the operation is done or after about 2 minutes
+
+        Args:
+            project_id (str): project ID the operation is in
+            zone (str): zone the operation is in, empty string for global operations
+            name (str): name of the operation
 
-    def _wait_for_global_operation(self, operation: Operation) -> bool:
-        """Wait for global operation to finish and check for errors
+        Returns:
+            compute_v1.Operation: latest state of the operation
+        """
+        if zone:
+            return self._retry(self.zone_op_client.wait, project=project_id, zone=zone, operation=name)
+        return self._retry(self.global_op_client.wait, project=project_id, operation=name)
+
+    def _wait_for_operation(self, operation: ExtendedOperation) -> bool:
+        """Wait for a zone or global operation to finish and check for errors. Uses the server side wait RPC so no
+        client side sleep is needed between calls. Operations that are already done are checked without an RPC
 
         Args:
-            operation (Operation): operation to wait for
+            operation (ExtendedOperation): operation to wait for
 
         Returns:
             bool: True if operation finished successfully, False otherwise
         """
-        while True:
-            result = self.get_global_operation(self.project_id, operation.name)
-            if result:
-                if result.status == compute_v1.Operation.Status.DONE:
-                    if result.error:
-                        self.log.error(f'Operation {operation.name} finished with error: {result.error}')
-                        return False
-                    self.display_success_msg(f'Operation {operation.name} completed successfully')
-                    return True
-                self.display_info_msg(f'Waiting for operation {operation.name} to complete...')
-            else:
-                self.log.error(f'Failed to get operation {operation.name}')
-                return False
-            sleep(3)
+        name = operation.name
+        timeout = self.poll_settings.total_timeout
+        deadline = monotonic() + timeout
+        result = operation
+        try:
+            if result.status != compute_v1.Operation.Status.DONE:
+                self.display_info_msg(f'Waiting for operation {name} to complete...')
+                project_id, zone = self.__operation_location(operation)
+            while result.status != compute_v1.Operation.Status.DONE:
+                if monotonic() >= deadline:
+                    self.log.error(f'Timed out waiting for operation {name} after {timeout} seconds')
+                    return False
+                result = self.__wait_rpc(project_id, zone, name)
+        except GoogleAPICallError as error:
+            self.log.error(f'Failed to wait for operation {name}: {error.message}')
+            return False
+        except Exception:
+            self.log.exception(f'Failed to wait for operation {name}')
+            return False
+        if result.error and result.error.errors:
+            for error in result.error.errors:
+                self.log.error(f'Operation {name} finished with error: {error.code}: {error.message}')
+            return False
+        for warning in result.warnings or []:
+            self.log.warning(f'Operation {name} warning: {warning.message}')
+        self.display_success_msg(f'Operation {name} completed successfully')
+        return True
 
     def get_instance_public_ip(self, project_id: str, zone: str, name: str) -> str | None:
         """Get the public IP address of a GCP instance
@@ -139,8 +253,7 @@ class GCPController(Utils):
         Returns:
             str | None: the public IP address of the instance, or None if not found
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
+        project_id = self._resolve_project_id(project_id)
         instance = self.get_instance(project_id, zone, name)
         if instance:
             for iface in instance.network_interfaces:
@@ -162,85 +275,111 @@ class GCPController(Utils):
         Returns:
             compute_v1.Instance | None: the GCP instance object, or None if not found
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
+        project_id = self._resolve_project_id(project_id)
         if self.client is not None:
             try:
-                return self.client.get(project=project_id, zone=zone, instance=name)
+                return self._retry(self.client.get, project=project_id, zone=zone, instance=name)
             except BadRequest as error:
                 self.log.error(f'Failed to get GCP instance: {error.message}')
             except Exception:
                 self.log.exception(f'Failed to get GCP instance {name}')
         return None
 
-    def get_zone_operation(self, project_id: str, zone: str, operation_name: str) -> Operation | None:
-        """Get a GCP zone operation object of name
+    def create_instance(self, project_id: str, zone: str, instance: compute_v1.Instance) -> ExtendedOperation | None:
+        """Create a GCP instance with the provided instance object
 
         Args:
-            project_id (str): project ID the operation is in
-            zone (str): the zone the operation is in
-            operation_name (str): the name of the operation
+            project_id (str): project ID to deploy the instance in
+            zone (str): the zone to deploy the instance in
+            instance (compute_v1.Instance): the instance object to create
 
         Returns:
-            Operation | None: the GCP operation object, or None if not found
+            ExtendedOperation | None: the GCP zone operation object, or None if not found
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
-        if self.zone_op_client is not None:
+        project_id = self._resolve_project_id(project_id)
+        if self.client is not None:
             try:
-                op: Operation = self.zone_op_client.get(project=project_id, zone=zone, operation=operation_name)
-                return op
+                return self._retry(self.client.insert, project=project_id, zone=zone, instance_resource=instance,
+                                   request_id=str(uuid4()))
             except BadRequest as error:
-                self.log.error(f'Failed to get GCP operation: {error.message}')
+                self.log.error(f'Failed to create GCP instance: {error.message}')
+                return None
             except Exception:
-                self.log.exception(f'Failed to get GCP operation {operation_name}')
+                self.log.exception('Failed to create GCP instance')
+                return None
         return None
 
-    def get_global_operation(self, project_id: str, operation_name: str) -> Operation | None:
-        """Get a GCP global operation object of name
+    @staticmethod
+    def __status_filter(statuses: frozenset[str]) -> str:
+        """Build a server side list filter that matches any of the statuses
 
         Args:
-            project_id (str): project ID the operation is in
-            operation_name (str): the name of the operation
+            statuses (frozenset[str]): instance statuses to match
 
         Returns:
-            Operation | None: the GCP operation object, or None if not found
+            str: list filter expression
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
-        if self.zone_op_client is not None:
+        return ' OR '.join(f'(status = "{status}")' for status in sorted(statuses))
+
+    def __list_instances(self, project_id: str, zone: str, statuses: frozenset[str]) -> Iterator[compute_v1.Instance]:
+        """List the GCP instances in the project and zone that have one of the statuses. The status filter is applied
+        server side and the response is limited to the instance name and status fields. Pages are fetched lazily as
+        the instances are consumed
+
+        Args:
+            project_id (str): project ID to get instances from
+            zone (str): the zone to get instances from
+            statuses (frozenset[str]): instance statuses to match
+
+        Yields:
+            compute_v1.Instance: partial instance objects with name and status set
+        """
+        request = compute_v1.ListInstancesRequest(
+            project=self._resolve_project_id(project_id),
+            zone=zone,
+            filter=self.__status_filter(statuses),
+            max_results=500,
+            return_partial_success=True
+        )
+        if self.client is not None:
             try:
-                op: Operation = self.global_op_client.get(project=project_id, operation=operation_name)
-                return op
+                yield from self._retry(self.client.list, request=request, metadata=[INSTANCE_LIST_FIELD_MASK])
             except BadRequest as error:
-                self.log.error(f'Failed to get GCP global operation: {error.message}')
+                self.log.error(f'Failed to get GCP instances: {error.message}')
             except Exception:
-                self.log.exception(f'Failed to get GCP global operation {operation_name}')
-        return None
+                self.log.exception('Failed to get GCP instances')
 
-    def create_instance(self, project_id: str, zone: str, instance: compute_v1.Instance) -> Operation | None:
-        """Create a GCP instance with the provided instance object
+    def get_all_instances(self, project_id: str) -> dict:
+        """Get the GCP instances in every zone of the project with a single aggregated list request
 
         Args:
-            project_id (str): project ID to deploy the instance in
-            zone (str): the zone to deploy the instance in
-            instance (compute_v1.Instance): the instance object to create
+            project_id (str): project ID to get instances from
 
         Returns:
-            Operation | None: the GCP zone operation object, or None if not found
+            dict: zone name mapped to a dictionary with two lists: 'running' and 'stopped' instances
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
+        request = compute_v1.AggregatedListInstancesRequest(
+            project=self._resolve_project_id(project_id),
+            filter=self.__status_filter(RUNNING_STATUSES | STOPPED_STATUSES),
+            max_results=500,
+            return_partial_success=True
+        )
+        zones = {}
         if self.client is not None:
             try:
-                return self.client.insert(project=project_id, zone=zone, instance_resource=instance)
+                pager = self._retry(self.client.aggregated_list, request=request, metadata=[AGGREGATED_LIST_FIELD_MASK])
+                for scope, scoped_list in pager:
+                    if not scoped_list.instances:
+                        continue
+                    instances = zones.setdefault(scope.split('/')[-1], {'running': [], 'stopped': []})
+                    for instance in scoped_list.instances:
+                        key = 'running' if instance.status in RUNNING_STATUSES else 'stopped'
+                        instances[key].append(instance.name)
             except BadRequest as error:
-                self.log.error(f'Failed to create GCP instance: {error.message}')
-                return None
+                self.log.error(f'Failed to get GCP instances: {error.message}')
             except Exception:
-                self.log.exception('Failed to create GCP instance')
-                return None
-        return None
+                self.log.exception('Failed to get GCP instances')
+        return zones
 
     def get_instances(self, project_id: str, zone: str) -> dict:
         """Get a list of GCP instances in the project and zone
@@ -252,21 +391,12 @@ class GCPController(Utils):
         Returns:
             dict: a dictionary with two lists: 'running' and 'stopped' instances
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
         instances = {'running': [], 'stopped': []}
-        if self.client is not None:
-            try:
-                for instance in self.client.list(project=project_id, zone=zone):
-                    status = instance.status
-                    if status == 'RUNNING':
-                        instances['running'].append(instance.name)
-                    elif status in ['TERMINATED', 'STOPPED', 'STOPPING']:
-                        instances['stopped'].append(instance.name)
-            except BadRequest as error:
-                self.log.error(f'Failed to get GCP instances: {error.message}')
-            except Exception:
-                self.log.exception('Failed to get GCP instances')
+        for instance in self.__list_instances(project_id, zone, RUNNING_STATUSES | STOPPED_STATUSES):
+            if instance.status in RUNNING_STATUSES:
+                instances['running'].append(instance.name)
+            else:
+                instances['stopped'].append(instance.name)
         return instances
 
     def get_running_instances(self, project_id: str, zone: str) -> list:
@@ -279,7 +409,7 @@ class GCPController(Utils):
         Returns:
             list: a list of running instance names
         """
-        return self.get_instances(project_id, zone).get('running', [])
+        return [instance.name for instance in self.__list_instances(project_id, zone, RUNNING_STATUSES)]
 
     def get_stopped_instances(self, project_id: str, zone: str) -> list:
         """Get a list of stopped GCP instances in the project and zone
@@ -291,7 +421,7 @@ class GCPController(Utils):
         Returns:
             list: a list of stopped instance names
         """
-        return self.get_instances(project_id, zone).get('stopped', [])
+        return [instance.name for instance in self.__list_instances(project_id, zone, STOPPED_STATUSES)]
 
     def delete_instance(self, project_id: str, zone: str, name: str) -> bool:
         """Delete a GCP instance with the provided name
@@ -304,13 +434,13 @@ class GCPController(Utils):
         Returns:
             bool: True if the instance was deleted successfully, False otherwise
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
+        project_id = self._resolve_project_id(project_id)
         if self.client is not None:
             try:
                 self.log.info(f'Deleting GCP instance {name}')
-                operation = self.client.delete(project=project_id, zone=zone, instance=name)
-                if operation and self._wait_for_zone_operation(operation, zone):
+                operation = self._retry(self.client.delete, project=project_id, zone=zone, instance=name,
+                                        request_id=str(uuid4()))
+                if operation and self._wait_for_operation(operation):
                     return self._delete_ansible_client_directory(name)
             except BadRequest as error:
                 self.log.error(f'Failed to delete GCP instance: {error.message}')
@@ -329,14 +459,14 @@ class GCPController(Utils):
         Returns:
             bool: True if the instance was started successfully, False otherwise
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
+        project_id = self._resolve_project_id(project_id)
         if self.client is not None:
             self.log.info(f'Starting GCP instance {name}')
             try:
-                operation = self.client.start(project=project_id, zone=zone, instance=name)
+                operation = self._retry(self.client.start, project=project_id, zone=zone, instance=name,
+                                        request_id=str(uuid4()))
                 if operation:
-                    return self._wait_for_zone_operation(operation, zone)
+                    return self._wait_for_operation(operation)
             except BadRequest as error:
                 self.log.error(f'Failed to start GCP instance: {error.message}')
             except Exception:
@@ -354,14 +484,14 @@ class GCPController(Utils):
         Returns:
             bool: True if the instance was stopped successfully, False otherwise
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
+        project_id = self._resolve_project_id(project_id)
         if self.client is not None:
             self.log.info(f'Stopping GCP instance {name}')
             try:
-                operation = self.client.stop(project=project_id, zone=zone, instance=name)
+                operation = self._retry(self.client.stop, project=project_id, zone=zone, instance=name,
+                                        request_id=str(uuid4()))
                 if operation:
-                    return self._wait_for_zone_operation(operation, zone)
+                    return self._wait_for_operation(operation)
             except BadRequest as error:
                 self.log.error(f'Failed to stop GCP instance: {error.message}')
             except Exception:
@@ -379,14 +509,14 @@ class GCPController(Utils):
         Returns:
             bool: True if the instance was rebooted successfully, False otherwise
         """
-        if project_id == 'default':
-            project_id = self._load_default_project_id()
+        project_id = self._resolve_project_id(project_id)
         if self.client is not None:
             try:
                 self.log.info(f'Restarting GCP instance {name}')
-                operation = self.client.reset(project=project_id, zone=zone, instance=name)
+                operation = self._retry(self.client.reset, project=project_id, zone=zone, instance=name,
+                                        request_id=str(uuid4()))
                 if operation:
-                    return self._wait_for_zone_operation(operation, zone)
+                    return self._wait_for_operation(operation)
             except BadRequest as error:
                 self.log.error(f'Failed to restart GCP instance: {error.message}')
             except Exception:
@@ -398,9 +528,11 @@ class GCPController(Utils):
 
         Args:
             project_id (str): project ID to get instances from
-            zone (str): the zone to get instances from
+            zone (str): the zone to get instances from. Use 'all' to display instances in every zone
 
         Returns:
             bool: True if the instances were displayed successfully, False otherwise
         """
+        if zone == 'all':
+            return self.display_info_msg(dumps(self.get_all_instances(project_id), indent=2))
         return self.display_info_msg(dumps(self.get_instances(project_id, zone), indent=2))
@@ -1,15 +1,62 @@
 import getpass
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
 from uuid import uuid4
 from logging import Logger
 from pathlib import Path
+from time import sleep, monotonic
 
 from google.cloud import compute_v1
-from google.api_core.operation import Operation
+from google.api_core.extended_operation import ExtendedOperation
 
-from kvm_2_gcp.gcp_controller import GCPController
+from kvm_2_gcp.gcp_controller import GCPController, STOPPED_STATUSES
 from kvm_2_gcp.remote_images import GCPImages
 
 
+@lru_cache(maxsize=64)
+def _read_file(path: str, mtime_ns: int) -> str:
+    """Read a text file once per modification time so batch deploys do not re-read the same keys and templates
+
+    Args:
+        path (str): path to the file
+        mtime_ns (int): modification time of the file used as part of the cache key
+
+    Returns:
+        str: file content
+    """
+    with open(path, 'r') as file:
+        return file.read()
+
+
+def _read_cached_file(path: str) -> str:
+    """Read a text file through the cache keyed on the file path and modification time
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str: file content
+    """
+    return _read_file(str(path), Path(path).stat().st_mtime_ns)
+
+
+@lru_cache(maxsize=64)
+def _sanitize_public_key(public_key: str, user: str) -> str:
+    """Replace the user@host comment of a public key with the user name
+
+    Args:
+        public_key (str): public key file content
+        user (str): user the key belongs to
+
+    Returns:
+        str: sanitized public key
+    """
+    key, separator, _ = public_key.strip().partition(f'{user}@')
+    if separator:
+        return f'{key.strip()} {user}'
+    return key
+
+
 class GCPDeploy(GCPController):
     def __init__(self, name: str, image: str, image_project: str = 'default', disk_size: int = 10,
                  disk_type: str = 'pd-balanced', project_id: str = 'default', zone: str = 'us-central1-a',
@@ -32,12 +79,12 @@ class GCPDeploy(GCPController):
             logger (Logger, optional): logger to use. Defaults to None.
         """
         super().__init__(logger=logger)
-        self.project_id = project_id if project_id != 'default' else self._load_default_project_id()
+        self.project_id = self._resolve_project_id(project_id)
         self._name = name if name != 'GENERATE' else f'vm-{uuid4().hex[:8]}'
         self._zone = zone
         self.__machine_type = machine_type
         self.__image = image
-        self.__image_project_id = image_project if image_project != 'default' else self._load_default_project_id()
+        self.__image_project_id = self._resolve_project_id(image_project)
         self.__disk_size = disk_size
         self.__disk_type = disk_type
         self.__network_tags = network_tags
@@ -50,16 +97,16 @@ class GCPDeploy(GCPController):
             else:
                 self.__users.append(user)
 
-    @property
+    @cached_property
     def images(self) -> GCPImages:
         """GCP Image object to get image details.
 
         Returns:
             GCPImages: GCPImages object to get image details.
         """
-        return GCPImages(self.__image_project_id)
+        return GCPImages(self.__image_project_id, self.log)
 
-    @property
+    @cached_property
     def __boot_initialize_params(self) -> compute_v1.AttachedDiskInitializeParams:
         """Create boot disk initialization parameters with disk size, image url, and disk type set.
 
@@ -74,7 +121,7 @@ class GCPDeploy(GCPController):
             disk_type=f'zones/{self._zone}/diskTypes/{self.__disk_type}'
         )
 
-    @property
+    @cached_property
     def __boot_disk(self) -> compute_v1.AttachedDisk:
         """Create boot disk object with auto-delete and boot set.
 
@@ -88,7 +135,7 @@ class GCPDeploy(GCPController):
             initialize_params=self.__boot_initialize_params
         )
 
-    @property
+    @cached_property
     def __machine_type_path(self) -> str:
         """Get the machine type path.
 
@@ -97,7 +144,7 @@ class GCPDeploy(GCPController):
         """
         return f'zones/{self._zone}/machineTypes/{self.__machine_type}'
 
-    @property
+    @cached_property
     def __network_interface(self) -> compute_v1.NetworkInterface:
         """Create network interface object with default VPC and 1 external IP.
 
@@ -111,7 +158,7 @@ class GCPDeploy(GCPController):
             )]
         )
 
-    @property
+    @cached_property
     def __instance_sa(self) -> compute_v1.ServiceAccount:
         """Create service account object with default compute SA set
 
@@ -123,20 +170,24 @@ class GCPDeploy(GCPController):
             scopes=['https://www.googleapis.com/auth/cloud-platform']
         )
 
-    @property
+    @cached_property
     def __meta_data(self) -> compute_v1.Metadata:
-        """Create metadata object with ssh keys and startup script set
+        """Create metadata object with ssh keys and startup script set. The key files and startup script are loaded
+        concurrently
 
         Returns:
             compute_v1.Metadata: metadata object.
         """
-        return compute_v1.Metadata(items=[
-                compute_v1.Items(key='ssh-keys', value=self.__load_public_keys()),
-                compute_v1.Items(key="startup-script", value=self.__load_startup_script()),
-            ]
-        )
-
-    @property
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            public_keys = executor.submit(lambda: self.__public_keys)
+            startup_script = executor.submit(self.__load_startup_script)
+            return compute_v1.Metadata(items=[
+                    compute_v1.Items(key='ssh-keys', value=public_keys.result()),
+                    compute_v1.Items(key="startup-script", value=startup_script.result()),
+                ]
+            )
+
+    @cached_property
     def __tags(self) -> compute_v1.Tags:
         """Create tags object with network tags set.
 
@@ -145,7 +196,7 @@ class GCPDeploy(GCPController):
         """
         return compute_v1.Tags(items=self.__network_tags)
 
-    @property
+    @cached_property
     def __instance(self) -> compute_v1.Instance:
         """Create instance object with name, machine type, disks, network interfaces, service accounts,
         metadata, and tags set.
@@ -170,8 +221,7 @@ class GCPDeploy(GCPController):
             str: startup script to run on instance creation.
         """
         try:
-            with open(f'{self.template_dir}/gcp-startup.sh', 'r') as file:
-                return file.read()
+            return _read_cached_file(f'{self.template_dir}/gcp-startup.sh')
         except Exception:
             self.log.exception('Failed to load startup script')
             return ''
@@ -187,18 +237,15 @@ class GCPDeploy(GCPController):
             str: public key or empty string if failed to load
         """
         try:
-            with open(public_key_file, 'r') as f:
-                public_key = f.read().strip()
-                if f'{user}@' in public_key:
-                    return public_key.split(f'{user}@')[0].strip() + f' {user}'
-                return public_key
+            return _sanitize_public_key(_read_cached_file(public_key_file), user)
         except Exception:
             self.log.exception(f'Failed to get public key {public_key_file}')
         return ''
 
-    def __load_public_keys(self) -> str:
+    @cached_property
+    def __public_keys(self) -> str:
         """Look up the public keys for the users specified in the __users list. Create a string with the format
-        <user>:<public_key> for each user.
+        <user>:<public_key> for each user. The users are fixed at construction so the result is cached.
 
         Returns:
             str: string with the format <user>:<public_key> for each user
@@ -228,26 +275,25 @@ class GCPDeploy(GCPController):
                     access: compute_v1.AccessConfig
                     if access.nat_i_p:
                         self.display_success_msg(f'Instance {self._name} created with external IP: {access.nat_i_p}')
-                        self.is_port_open(access.nat_i_p, max_attempts=24)
                         return access.nat_i_p
         return None
 
-    def __poll_operation(self, operation: Operation) -> str | None:
+    def __poll_operation(self, operation: ExtendedOperation) -> str | None:
         """Poll the operation to check if it is done and get the instance IP address on success
 
         Args:
-            operation (Operation): operation object to poll
+            operation (ExtendedOperation): operation object to poll
 
         Returns:
             str | None: external IP address of the instance or None if failed
         """
-        if self._wait_for_zone_operation(operation, self._zone):
+        if self._wait_for_operation(operation):
             instance = self.get_instance(self.project_id, self._zone, self._name)
             if instance:
                 status = instance.status
                 if status == 'RUNNING':
                     return self.__get_instance_ip(instance)
-                if status in ['TERMINATED', 'STOPPING', 'STOPPED']:
+                if status in STOPPED_STATUSES:
                     self.log.error(f'Instance {self._name} failed to deploy: {status}')
                     return None
         return None
@@ -264,15 +310,95 @@ class GCPDeploy(GCPController):
         users = ', '.join(self.__users)
         return self.display_success_msg(f'Successfully deployed VM {self._name} IP: {ip} User Access: {users}')
 
+    def __create(self) -> ExtendedOperation | None:
+        """Submit the create request for the VM instance on GCP.
+
+        Returns:
+            ExtendedOperation | None: the create operation or None if the request failed
+        """
+        return self.create_instance(self.project_id, self._zone, self.__instance)
+
+    def __operation_done(self, operation: ExtendedOperation) -> bool:
+        """Check if the create operation is done. A failed status check is treated as done so the error is reported
+        when the operation is waited on.
+
+        Args:
+            operation (ExtendedOperation): operation object to check
+
+        Returns:
+            bool: True if the operation is done or the check failed, False otherwise
+        """
+        try:
+            return operation.done()
+        except Exception:
+            self.log.exception(f'Failed to check operation {operation.name}')
+        return True
+
+    def __configure(self, operation: ExtendedOperation) -> bool:
+        """Wait for the create operation to finish then run the ansible playbook on the instance.
+
+        Args:
+            operation (ExtendedOperation): create operation of the instance
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        ip = self.__poll_operation(operation)
+        if ip and self.run_ansible_playbook(ip, self._name, self._playbook, port_attempts=24):
+            return self.__display_vm_info(ip)
+        return False
+
     def deploy(self) -> str | None:
         """Deploy the VM instance on GCP and run the ansible playbook if specified.
 
         Returns:
             str | None: external IP address of the instance or None if failed
         """
-        operation: Operation = self.create_instance(self.project_id, self._zone, self.__instance)
+        operation = self.__create()
         if operation:
-            ip = self.__poll_operation(operation)
-            if ip and self.run_ansible_playbook(ip, self._name, self._playbook):
-                return self.__display_vm_info(ip)
+            return self.__configure(operation)
         return None
+
+    @classmethod
+    def deploy_many(cls, specs: list[dict], max_workers: int = 16, logger: Logger = None) -> bool:
+        """Deploy multiple VM instances on GCP concurrently. All create requests are submitted in parallel, then the
+        create operations are polled together and each instance is configured as soon as its operation is done.
+
+        Args:
+            specs (list[dict]): GCPDeploy keyword arguments for each instance to deploy
+            max_workers (int, optional): max concurrent create or configure requests. Defaults to 16.
+            logger (Logger, optional): logger to use. Defaults to None.
+
+        Returns:
+            bool: True if all instances were deployed successfully, False otherwise
+        """
+        deployments = [cls(**spec, logger=logger) for spec in specs]
+        if not deployments:
+            return True
+        poller = deployments[0]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            operations = list(executor.map(lambda deployment: deployment.__create(), deployments))
+            success = all(operations)
+            pending = [(deployment, op) for deployment, op in zip(deployments, operations) if op]
+            configures = []
+            deadline = monotonic() + poller.poll_settings.total_timeout
+            attempt = 0
+            while pending:
+                waiting = []
+                for deployment, operation in pending:
+                    if deployment.__operation_done(operation):
+                        configures.append(executor.submit(deployment.__configure, operation))
+                    else:
+                        waiting.append((deployment, operation))
+                pending = waiting
+                if pending:
+                    if monotonic() >= deadline:
+                        for deployment, operation in pending:
+                            poller.log.error(f'Timed out waiting for operation {operation.name} to deploy '
+                                             f'{deployment._name}')
+                        success = False
+                        break
+                    sleep(poller._poll_delay(attempt))
+                    attempt += 1
+            results = [future.result() for future in configures]
+        return success and all(results)
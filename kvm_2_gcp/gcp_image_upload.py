@@ -1,16 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from logging import Logger
 from pathlib import Path
-from time import sleep
-from datetime import datetime
+from time import strftime
 
 from google.cloud.devtools import cloudbuild_v1
-from google.api_core.exceptions import NotFound, PermissionDenied
+from google.api_core.exceptions import GoogleAPICallError, NotFound, PermissionDenied
+from google.api_core.future.polling import DEFAULT_POLLING
 from google.api_core.operation import Operation
 
 from kvm_2_gcp.utils import Utils
 from kvm_2_gcp.cloud_storage import GCPCloudStorage
 
 
+BUILD_POLLING = DEFAULT_POLLING.with_delay(initial=2.0, maximum=30.0, multiplier=2.0)
+
+
 class GCPImageUpload(Utils):
     def __init__(self, image_name: str, name: str, family: str, bucket: str = 'default',
                  service_account: str = 'default', project_id: str = 'default', logger: Logger = None):
@@ -28,14 +33,22 @@ class GCPImageUpload(Utils):
         super().__init__(logger=logger)
         self.project_id = project_id if project_id != 'default' else self._load_default_project_id()
         self.__image_name = image_name
-        self.__name = name if name != 'default' else Path(self.__image_name).with_suffix('').name
+        self.__name = name if name != 'default' else Path(self.__image_name).stem
         self.__name = self.__name.replace('.', '-').replace(' ', '-')
         self.__family = family
         self.__bucket_image = f'k2g-images/{self.__image_name}'
         self.__storage = GCPCloudStorage(bucket, service_account, logger=self.log)
-        self.__scratch_dir = f'k2g-tmp/{datetime.now().strftime("%Y-%m-%d--%H-%M-%S")}'
 
-    @property
+    @cached_property
+    def __scratch_dir(self) -> str:
+        """Bucket scratch directory for the image import. The timestamp is set on first use
+
+        Returns:
+            str: bucket path of the scratch directory
+        """
+        return f'k2g-tmp/{strftime("%Y-%m-%d--%H-%M-%S")}'
+
+    @cached_property
     def __import_step(self) -> dict:
         """Cloud build import step
 
@@ -51,7 +64,7 @@ class GCPImageUpload(Utils):
             ]
         }
 
-    @property
+    @cached_property
     def __set_family_step(self) -> dict:
         """Cloud build step to set the image family
 
@@ -71,53 +84,69 @@ class GCPImageUpload(Utils):
         }
 
     def __upload_file_to_bucket(self) -> bool:
-        """Upload the image to the GCP bucket
+        """Upload the image to the GCP bucket. Skips the upload if the image is already in the bucket with a matching
+        checksum
 
         Returns:
             bool: True if upload was successful, False otherwise
         """
-        self.log.info(f'Uploading {self.__image_name} to GCP bucket')
         src = Path(f'{self.image_dir}/{self.__image_name}')
+        if not self.__storage.needs_upload(src, self.__bucket_image):
+            return True
+        self.log.info(f'Uploading {self.__image_name} to GCP bucket')
         return self.__storage.upload_from_file(src, self.__bucket_image, 'application/x-qemu-disk')
 
-    def __poll_build_state(self, client: cloudbuild_v1.CloudBuildClient, operation: Operation) -> bool:
-        """Poll the build state until it is completed or failed
+    def __poll_build_state(self, operation: Operation) -> bool:
+        """Wait for the build to complete or fail. The operation waiter polls with exponential backoff so the result
+        is reported shortly after the build finishes
 
         Args:
-            client (cloudbuild_v1.CloudBuildClient): cloud build client
-            operation (Operation): operation to poll
+            operation (Operation): build operation to wait for
 
         Returns:
             bool: True if the build was successful, False otherwise
         """
         build_id = operation.metadata.build.id
-        while True:
-            try:
-                build = client.get_build(project_id=self.project_id, id=build_id)
-                if build.status == cloudbuild_v1.Build.Status.SUCCESS:
-                    self.log.info(f"Image import build completed successfully: {build_id}")
-                    return True
-                elif build.status in [cloudbuild_v1.Build.Status.FAILURE,
-                                      cloudbuild_v1.Build.Status.INTERNAL_ERROR,
-                                      cloudbuild_v1.Build.Status.TIMEOUT,
-                                      cloudbuild_v1.Build.Status.CANCELLED]:
-                    self.log.error(f'Image import build {build_id} failed with state: {build.status.name}')
-                    return False
-                else:
-                    self.display_info_msg(f"Build {build_id} is running...")
-            except NotFound:
-                self.log.error(f"Build not found: {build_id}")
-                return False
-            sleep(30)
-
-    def __start_image_import_build(self) -> bool:
+        self.display_info_msg(f'Waiting for build {build_id} to complete...')
+        try:
+            build: cloudbuild_v1.Build = operation.result(timeout=1800, polling=BUILD_POLLING)
+        except TimeoutError:
+            self.log.error(f'Timed out waiting for image import build {build_id}')
+            return False
+        except NotFound:
+            self.log.error(f"Build not found: {build_id}")
+            return False
+        except GoogleAPICallError as error:
+            self.log.error(f'Image import build {build_id} failed: {error.message}')
+            return False
+        except Exception:
+            self.log.exception(f'Failed to wait for image import build {build_id}')
+            return False
+        if build.status == cloudbuild_v1.Build.Status.SUCCESS:
+            self.log.info(f"Image import build completed successfully: {build_id}")
+            return True
+        self.log.error(f'Image import build {build_id} failed with state: {build.status.name}')
+        return False
+
+    @cached_property
+    def __build(self) -> dict:
+        """Cloud build payload to import the image and set the image family
+
+        Returns:
+            dict: cloud build payload
+        """
+        return {'steps': [self.__import_step, self.__set_family_step], 'timeout': {'seconds': 1800}}
+
+    def __start_image_import_build(self, client: cloudbuild_v1.CloudBuildClient, build: dict) -> bool:
         """Start the image import build using Cloud Build
 
+        Args:
+            client (cloudbuild_v1.CloudBuildClient): cloud build client
+            build (dict): cloud build payload
+
         Returns:
             bool: True if the build was successful, False otherwise
         """
-        client = cloudbuild_v1.CloudBuildClient(credentials=self.creds)
-        build = {'steps': [self.__import_step, self.__set_family_step], 'timeout': {'seconds': 1800}}
         try:
             operation = client.create_build(project_id=self.project_id, build=build)
             self.log.info(f'Image import build started: {operation.metadata.build.id}')
@@ -127,26 +156,42 @@ class GCPImageUpload(Utils):
         except Exception:
             self.log.exception('Failed to start image import build')
             return False
-        return self.__poll_build_state(client, operation)
+        return self.__poll_build_state(operation)
 
-    def __cleanup_bucket(self) -> bool:
-        """Cleanup the bucket by deleting the image and scratch directory
+    def __cleanup_bucket(self, success: bool) -> bool:
+        """Cleanup the bucket after the build. On success the uploaded image is deleted, the import tool removes its own
+        scratch files. On failure the image and scratch directory are kept to troubleshoot or retry the import
+
+        Args:
+            success (bool): whether the image import build was successful
 
         Returns:
             bool: True if cleanup was successful, False otherwise
         """
-        for obj in [self.__bucket_image, self.__scratch_dir + '/']:
-            if not self.__storage.delete_object(obj, True):
-                return False
+        if success:
+            return self.__storage.delete_object(self.__bucket_image, True)
+        self.log.info(f'Keeping gs://{self.__storage.bucket}/{self.__bucket_image} and '
+                      f'gs://{self.__storage.bucket}/{self.__scratch_dir}/ for troubleshooting')
         return True
 
     def upload_image(self) -> bool:
         """Upload the image to GCP by uploading the image to the bucket then using cloud build to build the image.
-        Will delete the bucket data after the build is complete.
+        The build client and payload are prepared while the upload runs. Will delete the uploaded image after the build
+        is successful.
 
         Returns:
             bool: True if upload, build, and cleanup was successful else False
         """
-        if self.__upload_file_to_bucket() and self.__start_image_import_build():
-            return self.__cleanup_bucket()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            upload = executor.submit(self.__upload_file_to_bucket)
+            try:
+                client = self._get_client(cloudbuild_v1.CloudBuildClient)
+                build = self.__build
+            except Exception:
+                self.log.exception('Failed to prepare image import build')
+                client = None
+            uploaded = upload.result()
+        if uploaded and client is not None:
+            success = self.__start_image_import_build(client, build)
+            return self.__cleanup_bucket(success) and success
         return False
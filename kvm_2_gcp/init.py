@@ -1,12 +1,47 @@
+import os
 import getpass
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from platform import freedesktop_os_release
-from shutil import which, copytree
+from shlex import quote
+from fcntl import ioctl
+from shutil import which, copytree, copy2, copystat
 from json import dump
 
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
 from kvm_2_gcp.utils import Utils
 
 
+FICLONE = 0x40049409
+PKG_MATRIX = {
+    'debian': ('kvm', ['apt'], ['qemu-kvm', 'libvirt-daemon-system', 'libvirt-clients', 'virtinst', 'bridge-utils',
+                                'genisoimage']),
+    'rhel': ('qemu', ['dnf', 'yum'], ['qemu-kvm', 'libvirt', 'virt-install', 'libvirt-daemon-config-network',
+                                      'libvirt-daemon-kvm', 'bridge-utils', 'genisoimage'])
+}
+
+
+def _clone_file(src: str, dst: str) -> str:
+    """Copy a file as a copy-on-write reflink when the filesystem supports it, otherwise copy the file data
+
+    Args:
+        src (str): source file path
+        dst (str): destination file path
+
+    Returns:
+        str: destination file path
+    """
+    try:
+        with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+            ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        copystat(src, dst)
+        return dst
+    except OSError:
+        return copy2(src, dst)
+
+
 class Init(Utils):
     def __init__(self, sa_path: str, default_bucket: str = '', force: bool = False):
         """Initialize the KVM-2-GCP environment by setting up the service account and project ID.
@@ -28,26 +63,24 @@ class Init(Utils):
         self.__group = ''
 
     def __install_kvm_dependencies(self) -> bool:
-        """Install the KVM dependencies for the system
+        """Install the KVM dependencies for the system. The distro family is matched against both ID and ID_LIKE so
+        base distros that do not set ID_LIKE (ex: debian, rhel) are found as well as their derivatives
 
         Returns:
             bool: True if the dependencies were installed successfully, False otherwise
         """
-        os_id = freedesktop_os_release().get('ID_LIKE').lower()
-        if 'debian' in os_id:
-            self.__group = 'kvm'
-            pkgs = 'qemu-kvm libvirt-daemon-system libvirt-clients virtinst bridge-utils genisoimage'
-            return self._run_cmd(f'sudo apt install -y {pkgs}')[1]
-        if 'rhel' in os_id:
-            self.__group = 'qemu'
-            pkgs = 'qemu-kvm libvirt virt-install libvirt-daemon-config-network libvirt-daemon-kvm bridge-utils'
-            if which('dnf'):
-                return self._run_cmd(f'sudo dnf install -y {pkgs} genisoimage')[1]
-            if which('yum'):
-                return self._run_cmd(f'sudo yum install -y {pkgs} genisoimage')[1]
-            self.log.error(f'Unable to find package manager for RHEL based system: {os_id}')
-        else:
-            self.log.error(f'Unsupported OS: {os_id}')
+        release = freedesktop_os_release()
+        os_id = f"{release.get('ID', '')} {release.get('ID_LIKE', '')}".lower()
+        os_families = os_id.split()
+        for family, (group, managers, pkgs) in PKG_MATRIX.items():
+            if family in os_families:
+                self.__group = group
+                for manager in managers:
+                    if which(manager):
+                        return self._run_cmd(['sudo', manager, 'install', '-y', *pkgs])[1]
+                self.log.error(f'Unable to find package manager for {family} based system: {os_id}')
+                return False
+        self.log.error(f'Unsupported OS: {os_id}')
         return False
 
     def __start_and_enable_libvirt(self) -> bool:
@@ -56,22 +89,21 @@ class Init(Utils):
         Returns:
             bool: True if the service was started and enabled successfully, False otherwise
         """
-        return self._run_cmd('sudo systemctl enable --now libvirtd')[1]
+        return self._run_cmd(['sudo', 'systemctl', 'enable', '--now', 'libvirtd'])[1]
 
     def __set_directory_permissions(self) -> bool:
         """Set the permissions for the /k2g directory and its subdirectories. Sets ownership to the current user running
-        the init process. Recommended to run as non-root user.
+        the init process. Recommended to run as non-root user. The user and group are shell quoted since all
+        commands run in one sudo shell.
 
         Returns:
             bool: True if the permissions were set successfully, False otherwise
         """
         user = getpass.getuser()
-        if not self._run_cmd('sudo mkdir -p /k2g')[1]:
+        cmds = ['mkdir -p /k2g', f'chown -R {quote(user)}:{quote(self.__group)} /k2g', 'chmod -R 2770 /k2g',
+                'setfacl -d -m u::rwx /k2g', 'setfacl -d -m g::rwx /k2g', 'setfacl -d -m o::0 /k2g']
+        if not self._run_cmd(['sudo', 'sh', '-c', ' && '.join(cmds)])[1]:
             return False
-        for cmd in [f'chown -R {user}:{self.__group}', 'chmod -R 2770', 'setfacl -d -m u::rwx', 'setfacl -d -m g::rwx',
-                    'setfacl -d -m o::0']:
-            if not self._run_cmd(f'sudo {cmd} /k2g')[1]:
-                return False
         return self.__set_user_to_libvirt_group(user) and self.__set_directory_structure()
 
     def __set_user_to_libvirt_group(self, user: str) -> bool:
@@ -83,7 +115,7 @@ class Init(Utils):
         Returns:
             bool: True if the user was added successfully, False otherwise
         """
-        return self._run_cmd(f'sudo usermod -aG libvirt {user}')[1]
+        return self._run_cmd(['sudo', 'usermod', '-aG', 'libvirt', user])[1]
 
     def __set_directory_structure(self) -> bool:
         """Create the directory structure for the KVM-2-GCP environment
@@ -91,10 +123,8 @@ class Init(Utils):
         Returns:
             bool: True if the directory structure was created successfully, False otherwise
         """
-        for _dir in [self.image_dir, self.vm_dir, self.ansible_clients, self.ansible_playbooks, self.env_dir]:
-            if not self._run_cmd(f'mkdir -p {_dir}')[1]:
-                return False
-        return True
+        dirs = [self.image_dir, self.vm_dir, self.ansible_clients, self.ansible_playbooks, self.env_dir]
+        return self._run_cmd(['mkdir', '-p', *dirs])[1]
 
     def __create_env_key(self) -> bool:
         """Create the cipher key for encryption/decryption
@@ -186,38 +216,87 @@ class Init(Utils):
             bool: True if the Ansible files were created successfully, False otherwise
         """
         try:
-            copytree(f'{Path(__file__).parent}/ansible', self.ansible_dir, dirs_exist_ok=True)
+            copytree(f'{Path(__file__).parent}/ansible', self.ansible_dir, copy_function=_clone_file,
+                     dirs_exist_ok=True)
             return True
         except Exception:
             self.log.exception('Failed to create Ansible files')
             return False
 
-    def __create_ansible_ssh_keys(self) -> bool:
-        """Create SSH keys for Ansible to use to connect to VM instances
+    def __write_key_file(self, path: str, data: bytes, mode: int) -> bool:
+        """Write a key file created with the provided permissions
+
+        Args:
+            path (str): path to the key file
+            data (bytes): key content
+            mode (int): file permissions
 
         Returns:
             bool: True on success, False otherwise
         """
-        if Path(self.ansible_private_key).exists():
-            if self.__force:
-                if not self._run_cmd(f'rm -f {self.ansible_private_key}*')[1]:
-                    return False
-            else:
-                return True
-        if self._run_cmd(f'ssh-keygen -t rsa -b 4096 -C "ansible" -f {self.ansible_private_key} -N ""')[1]:
-            return self._run_cmd(f'chmod 600 {self.ansible_private_key}')[1]
+        try:
+            Path(path).unlink(missing_ok=True)
+            with open(os.open(path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, mode), 'wb') as file:
+                file.write(data)
+            return True
+        except Exception:
+            self.log.exception(f'Failed to write key file {path}')
         return False
 
+    def __create_ansible_ssh_keys(self) -> bool:
+        """Create Ed25519 SSH keys for Ansible to use to connect to VM instances. Existing RSA keys are kept unless
+        force is set
+
+        Returns:
+            bool: True on success, False otherwise
+        """
+        if Path(self.ansible_private_key).exists() and not self.__force:
+            return True
+        try:
+            key = ed25519.Ed25519PrivateKey.generate()
+            private_key = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH,
+                                            serialization.NoEncryption())
+            public_key = key.public_key().public_bytes(serialization.Encoding.OpenSSH,
+                                                       serialization.PublicFormat.OpenSSH) + b' ansible\n'
+        except Exception:
+            self.log.exception('Failed to generate Ansible SSH keys')
+            return False
+        return self.__write_key_file(self.ansible_private_key, private_key, 0o600) and \
+            self.__write_key_file(self.ansible_public_key, public_key, 0o644)
+
+    @staticmethod
+    def __run_steps(steps: list) -> bool:
+        """Run setup steps in order and stop at the first failure
+
+        Args:
+            steps (list): setup methods to run
+
+        Returns:
+            bool: True if all steps succeeded, False otherwise
+        """
+        return all(step() for step in steps)
+
     def run(self) -> bool:
-        """Run the initialization process for KVM-2-GCP
+        """Run the initialization process for KVM-2-GCP. The packages are installed first as the directory group depends
+        on them. The independent setup chains then run concurrently so key generation overlaps starting libvirt
 
         Returns:
             bool: True on success, False otherwise
         """
-        for method in [self.__install_kvm_dependencies, self.__start_and_enable_libvirt,
-                       self.__set_directory_permissions, self.__create_env_key, self.__create_credentials,
-                       self.__create_default_bucket_files, self.__create_ansible_files, self.__create_ansible_ssh_keys]:
-            if not method():
-                return False
+        if not self.__run_steps([self.__install_kvm_dependencies, self.__set_directory_permissions]):
+            return False
+        chains = [
+            [self.__start_and_enable_libvirt],
+            [self.__create_env_key, self.__create_credentials],
+            [self.__create_default_bucket_files],
+            [self.__create_ansible_files, self.__create_ansible_ssh_keys]
+        ]
+        with ThreadPoolExecutor(max_workers=len(chains)) as executor:
+            futures = [executor.submit(self.__run_steps, chain) for chain in chains]
+            for future in as_completed(futures):
+                if not future.result():
+                    for pending in futures:
+                        pending.cancel()
+                    return False
         self.log.info('Successfully initialized KVM-2-GCP Environment')
         return True
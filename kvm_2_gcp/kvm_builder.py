@@ -1,5 +1,4 @@
-from datetime import datetime
-from pathlib import Path
+from time import strftime
 from logging import Logger
 
 from kvm_2_gcp.kvm_deploy import KVMDeploy
@@ -20,7 +19,7 @@ class KVMBuilder(KVMDeploy):
             playbook (str, optional): build playbook to run to configure the system. Defaults to ''.
             logger (Logger, optional): logger to use. Defaults to None.
         """
-        name = name if name != 'GENERATE' else f'build-{datetime.now().strftime("%Y-%m-%d--%H-%M-%S")}'
+        name = name if name != 'GENERATE' else f'build-{strftime("%Y-%m-%d--%H-%M-%S")}'
         playbook = f'builds/{playbook}' if playbook else ''
         super().__init__(name, image, disk_size, cpu, memory, playbook, False, logger)
 
@@ -48,11 +47,8 @@ class KVMBuilder(KVMDeploy):
         Returns:
             bool: True if the build options were displayed successfully, False otherwise
         """
-        builds = []
-        for content in Path(self.__build_dir).glob('*.yml'):
-            builds.append(content.name)
-        builds.sort()
-        return self.display_info_msg(f'Available builds:\n  {"\n  ".join(builds)}')
+        builds = '\n  '.join(self._get_playbooks(self.__build_dir))
+        return self.display_info_msg(f'Available builds:\n  {builds}')
 
     def __run_build_playbook(self) -> bool:
         """Run the build playbook to configure the VM
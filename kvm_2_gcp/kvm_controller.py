@@ -1,15 +1,245 @@
+import atexit
 import json
-from ipaddress import ip_address, IPv4Address
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from io import StringIO
 from logging import Logger
-from time import sleep
+from math import log
+from threading import Event, Lock, Thread, local
+from time import monotonic, sleep
+from typing import Callable, Iterator
 from pathlib import Path
 from uuid import uuid4
-from os import remove
+from os import remove, scandir, unlink
+from shutil import rmtree
 from xml.etree import ElementTree
 
+import libvirt
+
 from kvm_2_gcp.utils import Utils
 
 
+LIBVIRT_URI = 'qemu:///system'
+POLL_DELAY_START = 0.001
+POLL_DELAY_MAX = 1.0
+RECONNECT_DELAY_MIN = 2.0
+RECONNECT_DELAY_MAX = 300.0
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+IPV4_RE = re.compile(r'^(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}(?:25[0-5]|2[0-4]\d|1?\d?\d)$')
+SIZE_RE = re.compile(r'^\s*(\d*\.?\d+)\s*([a-zA-Z]*)\s*$')
+SIZE_SHIFTS = {
+    '': 0, 'b': 0,
+    'k': 10, 'kb': 10, 'kib': 10,
+    'm': 20, 'mb': 20, 'mib': 20,
+    'g': 30, 'gb': 30, 'gib': 30,
+    't': 40, 'tb': 40, 'tib': 40,
+}
+BINARY_SUFFIXES = ('B', 'KiB', 'MiB', 'GiB', 'TiB', 'PiB')
+DECIMAL_SUFFIXES = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+NEW_NETWORK_XML = """<interface type='bridge'>
+  <source bridge='virbr0'/>
+  <model type='virtio'/>
+</interface>"""
+REMOVE_NETWORK_XML = """<interface type="bridge">
+  <mac address="{mac}"/>
+  <source bridge='virbr0'/>
+  <model type="virtio"/>
+</interface>"""
+REMOVE_DISK_XML = """<disk type='file' device='disk'>
+  <source file='{location}'/>
+  <target dev='{target}' bus='scsi'/>
+</disk>"""
+ATTACH_DISK_XML = """<disk type='file' device='disk'>
+  <driver name='qemu' type='qcow2' cache='none'/>
+  <source file='{location}'/>
+  <target dev='{target}' bus='scsi'/>
+  <serial>{serial}</serial>
+</disk>"""
+INSTANCE_LIST_FLAGS = {
+    'running': libvirt.VIR_CONNECT_LIST_DOMAINS_RUNNING,
+    'stopped': libvirt.VIR_CONNECT_LIST_DOMAINS_SHUTOFF,
+    'paused': libvirt.VIR_CONNECT_LIST_DOMAINS_PAUSED,
+}
+LIFECYCLE_STATES = {
+    libvirt.VIR_DOMAIN_EVENT_STARTED: 'running',
+    libvirt.VIR_DOMAIN_EVENT_RESUMED: 'running',
+    libvirt.VIR_DOMAIN_EVENT_SUSPENDED: 'paused',
+    libvirt.VIR_DOMAIN_EVENT_STOPPED: 'stopped',
+    libvirt.VIR_DOMAIN_EVENT_PMSUSPENDED: 'pmsuspended',
+    libvirt.VIR_DOMAIN_EVENT_CRASHED: 'crashed',
+}
+_EVENT_LOOP_LOCK = Lock()
+_EVENT_LOOP: Thread | None = None
+_CONNECTION_LOCK = Lock()
+_CONNECTION: libvirt.virConnect | None = None
+_RECONNECT_DELAY = 0.0
+_RECONNECT_AT = 0.0
+_STATE_LOCK = Lock()
+_DOMAIN_STATES: dict[str, str] | None = None
+
+
+class _InstanceSnapshot(local):
+    def __init__(self):
+        """Per thread instance snapshot state so concurrent VM operations on one controller never share a listing"""
+        self.depth = 0
+        self.instances: dict | None = None
+
+
+def _run_event_loop() -> None:
+    """Dispatch libvirt events forever. Runs in a daemon thread so it never blocks interpreter exit"""
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+def _ensure_event_loop() -> None:
+    """Register the default libvirt event implementation and start its dispatch thread once per process. This has to
+    happen before a connection is opened for domain event callbacks to fire.
+    """
+    global _EVENT_LOOP
+    with _EVENT_LOOP_LOCK:
+        if _EVENT_LOOP is None:
+            libvirt.virEventRegisterDefaultImpl()
+            _EVENT_LOOP = Thread(target=_run_event_loop, name='libvirt-events', daemon=True)
+            _EVENT_LOOP.start()
+
+
+def _close_connection() -> None:
+    """Close the shared libvirt connection at interpreter exit"""
+    if _CONNECTION is not None:
+        try:
+            _CONNECTION.close()
+        except libvirt.libvirtError:
+            pass
+
+
+atexit.register(_close_connection)
+
+
+def _get_connection() -> libvirt.virConnect:
+    """Open the libvirt connection once per process so the socket connect, auth and version handshake are paid a
+    single time no matter how many controllers are created. A connection that libvirtd dropped (ex: daemon restart)
+    is replaced with a new one. Keepalive closes the connection if libvirtd stops answering so calls fail instead of
+    hanging. Failed opens back off exponentially (2s doubling up to 5 min) and calls during the back off fail fast
+    without touching the socket.
+
+    Raises:
+        libvirt.libvirtError: libvirtd could not be reached or is in its back off period
+
+    Returns:
+        libvirt.virConnect: open connection to the system hypervisor
+    """
+    global _CONNECTION, _RECONNECT_DELAY, _RECONNECT_AT
+    with _CONNECTION_LOCK:
+        if _CONNECTION is not None:
+            if _CONNECTION.isAlive():
+                return _CONNECTION
+            _close_connection()
+            _CONNECTION = None
+        _ensure_event_loop()
+        _reset_domain_states()
+        if (wait := _RECONNECT_AT - monotonic()) > 0:
+            raise libvirt.libvirtError(f'libvirt at {LIBVIRT_URI} is unavailable, retrying in {wait:.0f} seconds')
+        try:
+            conn = libvirt.open(LIBVIRT_URI)
+            conn.setKeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_COUNT)
+        except libvirt.libvirtError:
+            _RECONNECT_DELAY = min(max(_RECONNECT_DELAY * 2, RECONNECT_DELAY_MIN), RECONNECT_DELAY_MAX)
+            _RECONNECT_AT = monotonic() + _RECONNECT_DELAY
+            raise
+        _RECONNECT_DELAY = 0.0
+        _RECONNECT_AT = 0.0
+        conn.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, _on_lifecycle_event, None)
+        _CONNECTION = conn
+        return _CONNECTION
+
+
+def _on_lifecycle_event(conn: libvirt.virConnect, dom: libvirt.virDomain, event: int, detail: int, opaque) -> None:
+    """Apply a libvirt lifecycle event to the shared domain state cache. Defining a VM only adds it as stopped when it
+    is new since redefining a running VM also fires the event, and undefining a running VM leaves it as transient.
+    """
+    name = dom.name()
+    with _STATE_LOCK:
+        if _DOMAIN_STATES is None or conn is not _CONNECTION:
+            return
+        if event == libvirt.VIR_DOMAIN_EVENT_DEFINED:
+            _DOMAIN_STATES.setdefault(name, 'stopped')
+        elif event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            if _DOMAIN_STATES.get(name) != 'running':
+                _DOMAIN_STATES.pop(name, None)
+        elif event in LIFECYCLE_STATES:
+            _DOMAIN_STATES[name] = LIFECYCLE_STATES[event]
+
+
+def _reset_domain_states() -> None:
+    """Drop the domain state cache so the next read lists the domains again"""
+    global _DOMAIN_STATES
+    with _STATE_LOCK:
+        _DOMAIN_STATES = None
+
+
+def _get_domain_states(conn: libvirt.virConnect) -> dict[str, str]:
+    """Get the state of every VM from the shared cache kept current by lifecycle events. The cache is seeded with one
+    listing per state the first time it is read on a connection. The lock is held while seeding so events that fire
+    during the listing are applied after it instead of being lost.
+
+    Args:
+        conn (libvirt.virConnect): connection the lifecycle callback is registered on
+
+    Returns:
+        dict[str, str]: copy of the VM name to state (running, stopped, paused) mapping
+    """
+    with _STATE_LOCK:
+        return dict(_seed_domain_states(conn))
+
+
+def _get_domain_state(conn: libvirt.virConnect, vm_name: str) -> str:
+    """Get the state of one VM from the shared lifecycle event cache without copying the whole mapping
+
+    Args:
+        conn (libvirt.virConnect): connection the lifecycle callback is registered on
+        vm_name (str): name of the VM to get the state of
+
+    Returns:
+        str: state of the VM (ex: running, stopped) or empty string if the VM does not exist
+    """
+    with _STATE_LOCK:
+        return _seed_domain_states(conn).get(vm_name, '')
+
+
+def _seed_domain_states(conn: libvirt.virConnect) -> dict[str, str]:
+    """Seed the lifecycle event cache with one listing per state if it is empty. Must be called with _STATE_LOCK held
+
+    Args:
+        conn (libvirt.virConnect): connection the lifecycle callback is registered on
+
+    Returns:
+        dict[str, str]: the shared VM name to state mapping
+    """
+    global _DOMAIN_STATES
+    if _DOMAIN_STATES is None:
+        states = {}
+        for state, flags in INSTANCE_LIST_FLAGS.items():
+            states.update(dict.fromkeys((dom.name() for dom in conn.listAllDomains(flags)), state))
+        _DOMAIN_STATES = states
+    return _DOMAIN_STATES
+
+
+def _disk_stem(location: str) -> str:
+    """Get the disk file name up to its first dot, which is how disk serials and by-id names are built. Uses partition
+    so no intermediate lists are allocated.
+
+    Args:
+        location (str): path to the disk file
+
+    Returns:
+        str: disk file name without directory or extensions
+    """
+    return location.rpartition('/')[2].partition('.')[0]
+
+
 class KVMController(Utils):
     def __init__(self, logger: Logger = None):
         """KVM controller to control KVM hypervisor
@@ -18,65 +248,131 @@ class KVMController(Utils):
             logger (Logger, optional): log object to use. Defaults to None.
         """
         super().__init__(logger=logger)
+        self._snapshot = _InstanceSnapshot()
 
     @property
-    def __new_network_data(self) -> str:
-        """string xml data to add a new network interface to a VM. Hardcoded to use bridge virbr0.
+    def _conn(self) -> libvirt.virConnect:
+        """Persistent libvirt connection shared by every controller in the process. libvirt connections are thread
+        safe so calls from worker threads do not need an extra lock.
 
         Returns:
-            str: xml data to add a new network interface
+            libvirt.virConnect: open connection to the system hypervisor
         """
-        return '''<interface type='bridge'>
-  <source bridge='virbr0'/>
-  <model type='virtio'/>
-</interface>'''
+        return _get_connection()
 
-    def __remove_network_data(self, mac: str) -> str:
-        """string xml data to remove a network interface from a VM using the mac address
+    def __get_domain(self, vm_name: str) -> libvirt.virDomain | None:
+        """Look up a VM on the persistent libvirt connection
 
         Args:
-            mac (str): MAC address of the network interface to remove
+            vm_name (str): name of the VM to look up
 
         Returns:
-            str: xml data to remove a network interface
+            libvirt.virDomain | None: domain object or None if not found
         """
-        return f'''<interface type="bridge">
-  <mac address="{mac}"/>
-  <source bridge='virbr0'/>
-  <model type="virtio"/>
-</interface>'''
+        try:
+            return self._conn.lookupByName(vm_name)
+        except libvirt.libvirtError:
+            self.log.exception(f'Failed to find VM {vm_name}')
+        return None
 
-    def __remove_disk_data(self, disk_location: str, target: str) -> str:
-        """string xml data to remove a disk from a VM using the disk location and target
+    def __domain_action(self, vm_name: str, action: str, *args) -> bool:
+        """Run a libvirt domain method (ex: create, shutdown, destroy) against a VM
 
         Args:
-            disk_location (str): location of the disk to remove (path to the disk file)
-            target (str): target of the disk to remove (ex: sda, sdb)
+            vm_name (str): name of the VM to run the action on
+            action (str): virDomain method name to call
+            *args: arguments to pass to the method
 
         Returns:
-            str: xml data to remove a disk
+            bool: True if successful, False otherwise
         """
-        return f'''<disk type='file' device='disk'>
-  <source file='{disk_location}'/>
-  <target dev='{target}' bus='scsi'/>
-</disk>'''
+        dom = self.__get_domain(vm_name)
+        if dom is None:
+            return False
+        try:
+            getattr(dom, action)(*args)
+            return True
+        except libvirt.libvirtError:
+            self.log.exception(f'Failed to {action} VM {vm_name}')
+        return False
+
+    def __get_disk_element(self, dom: libvirt.virDomain, target: str, flags: int = 0) -> ElementTree.Element | None:
+        """Find the disk device of a VM by its target in the domain XML
+
+        Args:
+            dom (libvirt.virDomain): domain to search
+            target (str): target of the disk to find (ex: sda, sdb)
+            flags (int, optional): XMLDesc flags, use VIR_DOMAIN_XML_INACTIVE for the persistent config and add
+                VIR_DOMAIN_XML_SECURE when the XML is written back so secrets (ex: graphics passwd) are kept.
+                Defaults to 0.
+
+        Returns:
+            ElementTree.Element | None: disk element or None if not found
+        """
+        root = ElementTree.fromstring(dom.XMLDesc(flags))
+        for disk in root.findall('.//devices/disk'):
+            target_elem = disk.find('target')
+            if target_elem is not None and target_elem.get('dev') == target:
+                return disk
+        return None
+
+    @contextmanager
+    def _instance_snapshot(self) -> Iterator[None]:
+        """Share a single instance listing between the helpers of one high-level operation. The snapshot is
+        dropped when the outermost context exits so later calls see live hypervisor state.
+
+        Yields:
+            Iterator[None]: nothing, the snapshot is read through _get_instances_cached
+        """
+        self._snapshot.depth += 1
+        try:
+            yield
+        finally:
+            self._snapshot.depth -= 1
+            if not self._snapshot.depth:
+                self._snapshot.instances = None
+
+    def _get_instances_cached(self) -> dict:
+        """Get the hypervisor instances, reusing the active snapshot if one is open.
+
+        Returns:
+            dict: dictionary of instances with the state as the key and a list of VM names as the value
+        """
+        if not self._snapshot.depth:
+            return self.get_instances()
+        if self._snapshot.instances is None:
+            self._snapshot.instances = self.get_instances()
+        return self._snapshot.instances
+
+    def _invalidate_instances_cache(self) -> None:
+        """Drop the cached instances after a VM state change so the next lookup queries libvirt again. The lifecycle
+        event cache is dropped as well since the event for the change may not have been delivered yet.
+        """
+        self._snapshot.instances = None
+        _reset_domain_states()
 
     def __instance_exists(self, vm_name: str, vms: list = None) -> bool:
         """Check if a VM exists on the hypervisor.
 
         Args:
             vm_name (str): name of the VM to check if it exists
-            vms (list, optional): list of vms to check. Defaults to None.
+            vms (list, optional): list of vms to check. Defaults to None and looks the VM up in the lifecycle event
+                cache.
 
         Returns:
             bool: True if the vm exists, False otherwise
         """
         if vms is None:
-            vms = self.get_instances()
+            try:
+                return _get_domain_state(self._conn, vm_name) in INSTANCE_LIST_FLAGS
+            except libvirt.libvirtError:
+                self.log.exception('Failed to list instances')
+                return False
         return vm_name in vms['running'] or vm_name in vms['stopped'] or vm_name in vms['paused']
 
     def __delete_vm_directory(self, vm_name: str) -> bool:
-        """Delete the VM directory and all its contents. Will also delete the ansible client directory
+        """Delete the VM directory and all its contents. Will also delete the ansible client directory. The disk
+        images in the top of the directory are unlinked concurrently as freeing large qcow2 files dominates the time.
 
         Args:
             vm_name (str): name of the VM to delete
@@ -87,27 +383,71 @@ class KVMController(Utils):
         dir_name = Path(f'{self.vm_dir}/{vm_name}')
         if dir_name.exists():
             self.log.info(f'Deleting VM directory {dir_name}')
-            return self._run_cmd(f'rm -rf {dir_name}')[1] and self._delete_ansible_client_directory(vm_name)
+            try:
+                files = [entry.path for entry in scandir(dir_name) if entry.is_file(follow_symlinks=False)]
+                if len(files) > 1:
+                    with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+                        list(executor.map(unlink, files))
+                rmtree(dir_name)
+            except Exception:
+                self.log.exception(f'Failed to delete VM directory {dir_name}')
+                return False
+            return self._delete_ansible_client_directory(vm_name)
         return True
 
-    def __get_vm_state(self, vm_name: str) -> str:
-        """Get the state of a VM using the virsh dominfo command.
+    def __wait_for_domain_event(self, vm_name: str, event_id: int, matches: Callable[[int], bool],
+                                ready: Callable[[libvirt.virDomain], bool], max_wait: int, action: str) -> bool:
+        """Block until libvirt reports a matching domain event or max_wait seconds pass. The callback is registered
+        before ready is checked so a transition that already happened is not missed. Progress is printed at most once
+        a second when stdout is a terminal, otherwise the wait blocks on the event with no output.
 
         Args:
-            vm_name (str): the name of the VM to get the state of
+            vm_name (str): name of the VM to watch
+            event_id (int): libvirt domain event ID to register for (ex: VIR_DOMAIN_EVENT_ID_LIFECYCLE)
+            matches (Callable[[int], bool]): returns True when the event type/state is the one waited on
+            ready (Callable[[libvirt.virDomain], bool]): returns True if the domain is already in the wanted state
+            max_wait (int): max seconds to wait for the event
+            action (str): what the VM is waiting to do, used in the progress message (ex: shutdown)
 
         Returns:
-            str: the state of the VM or an empty string if error
+            bool: True if the event was seen or the domain was already ready, False otherwise
         """
-        output = self._run_cmd(f'virsh dominfo {vm_name}')
-        if output[1]:
-            for line in output[0].splitlines():
-                if 'State' in line:
-                    return line.split(':')[-1].strip()
-        return ''
+        reached = Event()
+
+        def on_event(conn: libvirt.virConnect, dom: libvirt.virDomain, event: int, detail: int, opaque) -> None:
+            if matches(event):
+                reached.set()
+
+        try:
+            conn = self._conn
+            dom = conn.lookupByName(vm_name)
+            callback_id = conn.domainEventRegisterAny(dom, event_id, on_event, None)
+        except libvirt.libvirtError:
+            self.log.exception(f'Failed to register event callback for VM {vm_name}')
+            return False
+        try:
+            if ready(dom):
+                return True
+            if not sys.stdout.isatty():
+                self.log.debug(f'Waiting up to {max_wait} seconds for VM {vm_name} to {action}')
+                return reached.wait(max_wait)
+            start = monotonic()
+            deadline = start + max_wait
+            while (now := monotonic()) < deadline:
+                print(f'\rWaiting for VM {vm_name} to {action}. {int(now - start)}/{max_wait} seconds', end='')
+                if reached.wait(min(1.0, deadline - now)):
+                    print('')  # flush to new line on console
+                    return True
+            print('')  # flush to new line on console
+            return False
+        finally:
+            try:
+                conn.domainEventDeregisterAny(callback_id)
+            except libvirt.libvirtError:
+                pass  # connection dropped during the wait, the callback went with it
 
     def __wait_for_vm_shutdown(self, vm_name: str, max_wait: int = 60, force_shutdown: bool = True) -> bool:
-        """Wait for a VM to shutdown by checking the state of the VM every second. If the VM is not shutdown after
+        """Wait for a VM to shutdown by waiting on the libvirt lifecycle stopped event. If the VM is not shutdown after
         max_wait seconds, it will attempt to force shutdown the VM.
 
         Args:
@@ -117,66 +457,52 @@ class KVMController(Utils):
         Returns:
             bool: True if successful, False otherwise
         """
-        count = 0
-        while count < max_wait:
-            print(f'\rWaiting for VM {vm_name} to shutdown. {count}/{max_wait} seconds', end='')
-            if self.is_vm_stopped(vm_name):
-                print('')  # flush to new line on console
-                return True
-            count += 1
-            sleep(1)
-        print('')  # flush to new line on console
+        if self.__wait_for_domain_event(vm_name, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                                        lambda event: event == libvirt.VIR_DOMAIN_EVENT_STOPPED,
+                                        lambda dom: dom.state()[0] == libvirt.VIR_DOMAIN_SHUTOFF, max_wait,
+                                        'shutdown'):
+            return True
         if force_shutdown:
             self.log.info(f'VM {vm_name} failed to shutdown after {max_wait} seconds. Force shutting down...')
             return self.force_shutdown_vm(vm_name)
         self.log.error(f'Failed to shutdown VM {vm_name} after {max_wait} seconds')
         return False
 
-    def __undefine_vm(self, vm_name: str) -> bool:
-        """Undefine a VM using the virsh undefine command. This will remove the VM configuration from the hypervisor.
-        This method should be used when deleting a VM to remove all traces of the VM from the hypervisor.
+    def __agent_connected(self, dom: libvirt.virDomain) -> bool:
+        """Check if the qemu guest agent of a VM answers requests
 
         Args:
-            vm_name (str): the name of the VM to undefine
+            dom (libvirt.virDomain): domain to check
 
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if the guest agent is connected, False otherwise
         """
-        if self._run_cmd(f'virsh undefine {vm_name}')[1]:
+        try:
+            dom.interfaceAddresses(libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_AGENT)
             return True
-        self.log.error(f'Failed to undefine VM {vm_name}')
-        return False
+        except libvirt.libvirtError:
+            return False
 
-    def __split_size_suffix(self, size: str) -> tuple[float, str]:
-        """Split the provided size string into a tuple of the numeric part and the suffix part. The numeric part will be
-        converted to a float and the suffix part will be converted to lowercase. The suffix part will be empty if no
-        suffix is found. The numeric part will be 0.0 if no numeric part is found.
+    def __undefine_vm(self, vm_name: str) -> bool:
+        """Undefine a VM using the libvirt undefine call. This will remove the VM configuration from the hypervisor.
+        This method should be used when deleting a VM to remove all traces of the VM from the hypervisor.
 
         Args:
-            size (str): size string to split
+            vm_name (str): the name of the VM to undefine
 
         Returns:
-            tuple[float, str]: tuple of the numeric part and the suffix part
+            bool: True if successful, False otherwise
         """
-        digit = []
-        suffix = []
-        decimal_found = False
-        for char in size:
-            if char.isdigit() or (char == '.' and not decimal_found):
-                if char == '.':
-                    decimal_found = True
-                digit.append(char)
-            elif char.isalpha():
-                suffix.append(char)
-        try:
-            return float(''.join(digit)), ''.join(suffix).lower()
-        except ValueError:
-            self.log.error(f'Unable to parse numeric part from size: {size}')
-            return 0.0, ''
+        self._invalidate_instances_cache()
+        if self.__domain_action(vm_name, 'undefine'):
+            return True
+        self.log.error(f'Failed to undefine VM {vm_name}')
+        return False
 
     def __convert_size_to_bytes(self, size: int | str) -> int:
         """Convert the provided size to bytes. If the size is a string, it can be a number with a suffix (k, m, g, t)
-        or a number without a suffix. The suffix can be in lowercase or uppercase.
+        or a number without a suffix. The suffix can be in lowercase or uppercase. Whole numbers stay in integer math
+        with a bit shift, only fractional sizes go through a float multiply.
 
         Args:
             size (int | str): size to convert to bytes
@@ -187,18 +513,17 @@ class KVMController(Utils):
         if isinstance(size, int):
             return size
         if isinstance(size, str):
-            if size.isdigit():
-                return int(size)
-            digit, suffix = self.__split_size_suffix(size)
-            if suffix in ['t', 'tb', 'tib']:
-                return int(digit * 1024 ** 4)
-            if suffix in ['g', 'gb', 'gib']:
-                return int(digit * 1024 ** 3)
-            if suffix in ['m', 'mb', 'mib']:
-                return int(digit * 1024 ** 2)
-            if suffix in ['k', 'kb', 'kib']:
-                return int(digit * 1024)
-            self.log.error(f'Invalid size suffix: {suffix}')
+            match = SIZE_RE.match(size)
+            if not match:
+                self.log.error(f'Unable to parse numeric part from size: {size}')
+                return 0
+            shift = SIZE_SHIFTS.get(match[2].lower())
+            if shift is None:
+                self.log.error(f'Invalid size suffix: {match[2]}')
+                return 0
+            if '.' in match[1]:
+                return int(float(match[1]) * (1 << shift))
+            return int(match[1]) << shift
         else:
             self.log.error(f'Invalid size type: {size}, {type(size)}')
         return 0
@@ -220,7 +545,7 @@ class KVMController(Utils):
             return False
         name = name if name != 'GENERATE' else 'data-' + uuid4().hex[:8]
         disk_name = f'{self.vm_dir}/{vm_name}/{name}.qcow2'
-        if self._run_cmd(f'qemu-img create -f qcow2 {disk_name} {size}')[1]:
+        if self._run_cmd(['qemu-img', 'create', '-f', 'qcow2', disk_name, str(size)])[1]:
             self.log.info(f'Successfully created data disk {disk_name} for {vm_name}')
             return disk_name
         self.log.error(f'Failed to create data disk {disk_name} for {vm_name}')
@@ -237,9 +562,7 @@ class KVMController(Utils):
         """
         disks = self.get_vm_disks(vm_name)
         if disks:
-            targets = list(disks.keys())
-            targets.sort()
-            last_target = targets[-1].lower()
+            last_target = max(disks, key=lambda target: (len(target), target)).lower()
             if last_target[-1] == 'z':
                 self.log.error('No more targets available')
                 return ''
@@ -247,7 +570,8 @@ class KVMController(Utils):
         return 'sda'
 
     def __attach_data_disk(self, vm_name: str, disk_name: str, vms: dict) -> bool:
-        """Attach a data disk to a VM using the virsh attach-disk command.
+        """Attach a data disk to a VM using libvirt attachDeviceFlags. The disk is persisted to the VM config and
+        hot plugged as well if the VM is running.
 
         Args:
             vm_name (str): name of the VM to attach the disk to
@@ -257,34 +581,46 @@ class KVMController(Utils):
         Returns:
             bool: True if successful, False otherwise
         """
-        serial = f'{vm_name}-{disk_name.split("/")[-1].split(".")[0]}'
+        serial = f'{vm_name}-{_disk_stem(disk_name)}'
         target = self.__find_next_vm_target_disk(vm_name)
         if not target:
             self.log.error(f'Failed to find target for data disk {disk_name} on {vm_name}')
             return False
-        live = ' --live' if vm_name in vms.get('running', []) else ''
-        cmd = f'virsh attach-disk {vm_name} {disk_name} --driver qemu --subdriver qcow2 --cache none --serial {serial}'
-        cmd += f' --target {target} --targetbus scsi{live} --persistent'
-        if self._run_cmd(cmd)[1]:
+        disk_data = ATTACH_DISK_XML.format(location=disk_name, target=target, serial=serial)
+        if self.__domain_action(vm_name, 'attachDeviceFlags', disk_data, self.__device_flags(vm_name, vms)):
             self.log.info(f'Successfully attached data disk {disk_name} to {vm_name}')
             return True
         self.log.error(f'Failed to attach data disk {disk_name} to {vm_name}')
         return False
 
-    def __remove_instance_cdrom(self, vm_name: str, target: str) -> bool:
-        """Remove a CDROM device from a VM using the virsh detach-disk command.
+    def __remove_instance_cdrom(self, vm_name: str, target: str, instances: dict = None) -> bool:
+        """Remove a CDROM device from a VM using libvirt detachDeviceFlags. The running state is taken from the
+        provided instances, falling back to the domain state when the caller has none.
 
         Args:
             vm_name (str): name of the VM to remove the CDROM from
             target (str): target of the CDROM to remove (ex: sda, sdb)
+            instances (dict, optional): hypervisor instances. Defaults to None.
 
         Returns:
             bool: True if successful, False otherwise
         """
-        live = ' --live' if self.is_vm_running(vm_name) else ''
-        if self._run_cmd(f'virsh detach-disk {vm_name} {target}{live} --config')[1]:
-            self.log.info(f'Removed {target} from {vm_name}')
-            return True
+        dom = self.__get_domain(vm_name)
+        if dom is not None:
+            try:
+                disk = self.__get_disk_element(dom, target, libvirt.VIR_DOMAIN_XML_INACTIVE)
+                if disk is not None:
+                    if instances:
+                        flags = self.__device_flags(vm_name, instances)
+                    else:
+                        flags = libvirt.VIR_DOMAIN_AFFECT_CONFIG
+                        if dom.state()[0] == libvirt.VIR_DOMAIN_RUNNING:
+                            flags |= libvirt.VIR_DOMAIN_AFFECT_LIVE
+                    dom.detachDeviceFlags(ElementTree.tostring(disk, encoding='unicode'), flags)
+                    self.log.info(f'Removed {target} from {vm_name}')
+                    return True
+            except libvirt.libvirtError:
+                self.log.exception(f'Failed to detach {target} from {vm_name}')
         self.log.error(f'Failed to remove {target} from {vm_name}')
         return False
 
@@ -302,13 +638,17 @@ class KVMController(Utils):
         Returns:
             str: human readable unit conversion to 3 decimal places or original bytes on failure
         """
-        suffixes = ['B', 'KiB', 'MiB', 'GiB', 'TiB', 'PiB']
+        suffixes = BINARY_SUFFIXES if base == 1024 else DECIMAL_SUFFIXES
         try:
             num = float(unit)
-            while num >= base and unit_index < len(suffixes) - 1:
-                num /= 1024.0
-                unit_index += 1
-            suffix = suffixes[unit_index] if base == 1024 else suffixes[unit_index].replace('i', '')
+            if num >= base:
+                steps = min(int(log(num, base)), len(suffixes) - 1 - unit_index)
+                num /= base ** steps
+                if num >= base and unit_index + steps < len(suffixes) - 1:
+                    num /= base  # log rounded down just below an exact power of base
+                    steps += 1
+                unit_index += steps
+            suffix = suffixes[unit_index]
             if num.is_integer():
                 return f"{int(num)} {suffix}"
             return f"{num:.3f} {suffix}"
@@ -317,8 +657,9 @@ class KVMController(Utils):
         return f'{unit}'
 
     def __get_shutdown_vm_interfaces(self, vm_name: str) -> dict:
-        """Get the interfaces attached to a VM using the virsh dumpxml command. It will return a dictionary of
-        found interfaces with their mac, source, and model.
+        """Get the interfaces attached to a VM from the libvirt domain XML. It will return a dictionary of
+        found interfaces with their mac, source, and model. The XML is streamed and parsing stops once the devices
+        section closes so the full element tree is never built.
 
         Args:
             vm_name (str): name of the vm to get the interfaces for
@@ -327,156 +668,93 @@ class KVMController(Utils):
             dict: vm interfaces dict
         """
         interfaces = {}
-        rsp = self._run_cmd(f'virsh dumpxml {vm_name}')
-        if rsp[1]:
-            root = ElementTree.fromstring(rsp[0])
+        dom = self.__get_domain(vm_name)
+        if dom is not None:
+            try:
+                xml = dom.XMLDesc(0)
+            except libvirt.libvirtError:
+                self.log.exception(f'Failed to get interfaces for {vm_name}')
+                return interfaces
             cnt = 1
-            for iface in root.findall(".//devices/interface"):
+            for _, elem in ElementTree.iterparse(StringIO(xml), events=('end',)):
+                if elem.tag == 'devices':
+                    break
+                if elem.tag != 'interface':
+                    continue
                 interfaces[cnt] = {}
-                mac_elem = iface.find('mac')
-                source = iface.find('source')
-                model = iface.find('model')
+                mac_elem = elem.find('mac')
+                source = elem.find('source')
+                model = elem.find('model')
                 if mac_elem is not None:
                     interfaces[cnt]['mac'] = mac_elem.get('address')
                 if source is not None:
                     interfaces[cnt]['source'] = source.get('bridge')
                 if model is not None:
                     interfaces[cnt]['model'] = model.get('type')
+                elem.clear()
                 cnt += 1
         return interfaces
 
-    def __display_vm_is_up(self, vm_name: str, ignore_error: bool = False) -> str:
-        """Display the IP address of a VM using the virsh guestinfo command. This will display the IP address of the VM
-        to console.
+    def __display_vm_is_up(self, vm_name: str) -> str:
+        """Display the IP address of a VM reported by the qemu guest agent. This will display the IP address of the VM
+        to console once the agent reports an IPv4 address.
 
         Args:
             vm_name (str): name of the VM to display the IP address
-            ignore_error (bool, optional): option to ignore any error. Defaults to False.
 
         Returns:
             str: IP address of the VM or empty string if not found
         """
         ip = self.get_vm_ip_by_index(vm_name)
-        if ip:
-            try:
-                ip_obj = ip_address(ip)
-                if isinstance(ip_obj, IPv4Address):
-                    self.display_success_msg(f'\nVM {vm_name} is up. IP: {ip}')
-                    return ip
-            except Exception:
-                if ignore_error:
-                    return False
-                self.log.error(f'Invalid IP address for {vm_name}: {ip}')
+        if ip and IPV4_RE.match(ip):
+            self.display_success_msg(f'\nVM {vm_name} is up. IP: {ip}')
+            return ip
         return ''
 
-    def __create_add_network_file(self, vm_name: str) -> str:
-        """Create xml file that will create a new network interface for a VM. The file is located in the VM directory
-        and will be auto-deleted when the interface is created or overridden when attempted to be created again.
+    def __device_flags(self, vm_name: str, instances: dict = None) -> int:
+        """Get the libvirt device flags for a VM. Changes always go to the persistent config and are applied live
+        as well if the VM is running.
 
         Args:
-            vm_name (str): name of the vm to create the network interface for
-
-        Returns:
-            str: xml file path
-        """
-        config_file = f'{self.vm_dir}/{vm_name}/add-network.xml'
-        try:
-            with open(config_file, 'w') as file:
-                file.write(self.__new_network_data + '\n')
-            return config_file
-        except Exception:
-            self.log.exception(f'Failed to create network interface file {config_file}')
-        return ''
-
-    def __create_remove_network_file(self, vm_name: str, mac: str) -> str:
-        """Create xml file that will remove a network interface for a VM. The file is located in the VM directory
-
-        Args:
-            vm_name (str): name of the vm to remove the network interface for
-            mac (str): mac address of the network interface to remove
-
-        Returns:
-            str: xml file path
-        """
-        config_file = f'{self.vm_dir}/{vm_name}/remove-network.xml'
-        try:
-            with open(config_file, 'w') as file:
-                file.write(self.__remove_network_data(mac) + '\n')
-            return config_file
-        except Exception:
-            self.log.exception(f'Failed to create network remove file {config_file}')
-        return ''
-
-    def __create_remove_disk_file(self, vm_name: str, disk_location: str, target: str) -> str:
-        """Create xml file that will remove a disk from a VM. The file is located in the VM directory and will be
-        auto-deleted when the disk is removed or overridden when attempted to be removed again.
-
-        Args:
-            vm_name (str): name of the vm to remove the disk from
-            disk_location (str): location of the disk to remove
-            target (str): target of the disk to remove (ex: sda, sdb)
-
-        Returns:
-            str: xml file path
-        """
-        config_file = f'{self.vm_dir}/{vm_name}/remove-disk.xml'
-        try:
-            with open(config_file, 'w') as file:
-                file.write(self.__remove_disk_data(disk_location, target) + '\n')
-            return config_file
-        except Exception:
-            self.log.exception(f'Failed to create disk remove file {config_file}')
-        return ''
-
-    def __remove_config_file(self, config_file: str) -> bool:
-        """Delete the config file after use.
-
-        Args:
-            config_file (str): path to the config file to delete
+            vm_name (str): name of the VM the device change is for
+            instances (dict, optional): hypervisor instances. Defaults to None.
 
         Returns:
-            bool: True if successful, False otherwise
+            int: VIR_DOMAIN_AFFECT_* flags
         """
-        try:
-            remove(config_file)
-            return True
-        except Exception:
-            self.log.exception(f'Failed to remove file {config_file}')
-        return False
+        if not instances:
+            instances = self._get_instances_cached()
+        if vm_name in instances.get('running', []):
+            return libvirt.VIR_DOMAIN_AFFECT_CONFIG | libvirt.VIR_DOMAIN_AFFECT_LIVE
+        return libvirt.VIR_DOMAIN_AFFECT_CONFIG
 
-    def __attach_device(self, vm_name: str, config_file: str, instances: dict = None) -> bool:
-        """Attach a device to a VM using the virsh attach-device command. This will use the xml config file to
-        attach certain devices to the VM. The config file is located in the VM directory
+    def __attach_device(self, vm_name: str, device_xml: str, instances: dict = None) -> bool:
+        """Attach a device to a VM using libvirt attachDeviceFlags. This will use the xml device data to
+        attach certain devices to the VM.
 
         Args:
             vm_name (str): name of the VM to attach the device to
-            config_file (str): the path to the xml config file to attach
+            device_xml (str): xml data of the device to attach
             instances (dict, optional): hypervisor instances. Defaults to None.
 
         Returns:
             bool: True if successful, False otherwise
         """
-        if not instances:
-            instances = self.get_instances()
-        live = ' --live --persistent' if vm_name in instances.get('running', []) else ''
-        return self._run_cmd(f'virsh attach-device {vm_name} {config_file} --config{live}')[1]
+        return self.__domain_action(vm_name, 'attachDeviceFlags', device_xml, self.__device_flags(vm_name, instances))
 
-    def __detach_device(self, vm_name: str, config_file: str, instances: dict = None) -> bool:
-        """Detach a device from a VM using the virsh detach-device command. This will use the xml config file to
-        remove certain devices from the VM. The config file is located in the VM directory
+    def __detach_device(self, vm_name: str, device_xml: str, instances: dict = None) -> bool:
+        """Detach a device from a VM using libvirt detachDeviceFlags. This will use the xml device data to
+        remove certain devices from the VM.
 
         Args:
             vm_name (str): vm name to detach the device from
-            config_file (str): path to the xml config file to detach
+            device_xml (str): xml data of the device to detach
             instances (dict, optional): hypervisor instances. Defaults to None.
 
         Returns:
             bool: True if successful, False otherwise
         """
-        if not instances:
-            instances = self.get_instances()
-        live = ' --live --persistent' if vm_name in instances.get('running', []) else ''
-        return self._run_cmd(f'virsh detach-device {vm_name} {config_file} --config{live}')[1]
+        return self.__domain_action(vm_name, 'detachDeviceFlags', device_xml, self.__device_flags(vm_name, instances))
 
     def __unmount_system_disk(self, vm_name: str, device: str, disks: dict) -> bool:
         """Unmount a system disk from a VM using the ansible playbook. This will run the unmount_disk.yml playbook
@@ -491,7 +769,7 @@ class KVMController(Utils):
         """
         ip = self.get_vm_ip_by_index(vm_name)
         if ip:
-            device_name = f'{vm_name}-{disks[device]["location"].split("/")[-1].split(".")[0]}-part1'
+            device_name = f'{vm_name}-{_disk_stem(disks[device]["location"])}-part1'
             if self.run_ansible_playbook(ip, vm_name, 'unmount_disk.yml', {'device_name': device_name}):
                 self.log.info(f'Successfully unmounted {device} on {vm_name}')
                 return True
@@ -522,8 +800,7 @@ class KVMController(Utils):
         return False
 
     def __remove_data_disk(self, vm_name: str, device: str, disks: dict, vms: dict) -> bool:
-        """Remove a data disk from a VM using the virsh detach-device command. It creates an xml config file to remove
-        the device then, removes the disk then deletes the config file.
+        """Remove a data disk from a VM using libvirt detachDeviceFlags.
 
         Args:
             vm_name (str): name of the VM to remove the disk from
@@ -534,11 +811,10 @@ class KVMController(Utils):
         Returns:
             bool: True if successful, False otherwise
         """
-        config_file = self.__create_remove_disk_file(vm_name, disks[device]['location'], device)
-        if config_file and self.__detach_device(vm_name, config_file, vms):
-            if self.__remove_config_file(config_file):
-                self.log.info(f'Successfully removed disk {device} from {vm_name}')
-                return True
+        disk_data = REMOVE_DISK_XML.format(location=disks[device]['location'], target=device)
+        if self.__detach_device(vm_name, disk_data, vms):
+            self.log.info(f'Successfully removed disk {device} from {vm_name}')
+            return True
         self.log.error(f'Failed to remove disk {device} from {vm_name}')
         return False
 
@@ -570,10 +846,10 @@ class KVMController(Utils):
         Returns:
             bool: True if the VM is not running or shutdown successfully, False otherwise
         """
-        vms = self.get_instances()
+        vms = self._get_instances_cached()
         if vm_name in vms.get('running', []):
             if force or input(f'VM {vm_name} is running. Shutdown? [y/n]: ').lower() == 'y':
-                if not self.shutdown_vm(vm_name):
+                if not self.shutdown_vm(vm_name, instances=vms):
                     return False
             else:
                 self.log.error(f'VM {vm_name} is running. Cannot increase disk size')
@@ -596,58 +872,74 @@ class KVMController(Utils):
         """
         if self.__validate_disk_change(vm_name, force):
             size_bytes = self.__convert_size_to_bytes(size)
-            if size_bytes and self._run_cmd(f'qemu-img resize {device} +{size_bytes}')[1]:
+            if size_bytes and self._run_cmd(['qemu-img', 'resize', device, f'+{size_bytes}'])[1]:
                 self.log.info(f'Successfully increased disk {device} by {size}')
                 return True
             self.log.error(f'Failed to increase disk {device}')
         return False
 
-    def __set_vm_memory(self, vm_name: str, memory: int) -> bool:
-        """Sets the VMs memory by setting the setmaxmem and setmem virsh commands, setting the allowed max memory
-        and the current memory
+    def __update_domain_xml(self, vm_name: str, mutator: Callable[[ElementTree.Element], None]) -> bool:
+        """Apply a change to the persistent domain XML of a VM and redefine it in one libvirt call. The XML is read
+        with VIR_DOMAIN_XML_SECURE so secrets such as the graphics password survive the redefine.
 
         Args:
-            vm_name (str): name of the vm to set the memory for
-            memory (int): new memory size in MB
+            vm_name (str): name of the vm to update
+            mutator (Callable[[ElementTree.Element], None]): function that edits the parsed domain XML in place
 
         Returns:
             bool: True if successful, False otherwise
         """
-        if not memory:
-            return True
-        memory_kb = memory * 1024
-        if not self._run_cmd(f'virsh setmaxmem {vm_name} {memory_kb} --config')[1]:
-            self.log.error(f'Failed to set max memory for {vm_name} to {memory_kb} KiB')
+        dom = self.__get_domain(vm_name)
+        if dom is None:
             return False
-        self.log.info(f'Successfully set max memory for {vm_name} to {memory_kb} KiB')
-        if not self._run_cmd(f'virsh setmem {vm_name} {memory_kb} --config')[1]:
-            self.log.error(f'Failed to set current memory for {vm_name} to {memory_kb} KiB')
-            return False
-        self.log.info(f'Successfully set current memory for {vm_name} to {memory_kb} KiB')
-        return True
+        try:
+            root = ElementTree.fromstring(dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE | libvirt.VIR_DOMAIN_XML_SECURE))
+            mutator(root)
+            self._conn.defineXML(ElementTree.tostring(root, encoding='unicode'))
+            return True
+        except libvirt.libvirtError:
+            self.log.exception(f'Failed to update domain config for {vm_name}')
+        return False
 
-    def __set_vm_cpu(self, vm_name: str, cpu: int) -> bool:
-        """Sets the CPU count for a VM using the virsh setvcpus command. This will set the max CPU count and the
-        current CPU count for the VM.
+    def __set_vm_cpu_memory(self, vm_name: str, cpu: int, memory: int) -> bool:
+        """Sets the max and current CPU count and memory of a VM in its persistent config. Both are written with a
+        single domain XML update instead of one call per setting.
 
         Args:
-            vm_name (str): name of the vm to set the CPU count for
-            cpu (int): number of CPUs to set for the VM
+            vm_name (str): name of the vm to set the resources for
+            cpu (int): number of CPUs to set for the VM, 0 to leave unchanged
+            memory (int): new memory size in MB, 0 to leave unchanged
 
         Returns:
             bool: True if successful, False otherwise
         """
-        if not cpu:
+        if not cpu and not memory:
             return True
-        if not self._run_cmd(f'virsh setvcpus {vm_name} {cpu} --maximum --config')[1]:
-            self.log.error(f'Failed to set max CPU count for {vm_name}')
-            return False
-        self.log.info(f'Successfully set max CPU count for {vm_name} to {cpu}')
-        if not self._run_cmd(f'virsh setvcpus {vm_name} {cpu} --config')[1]:
-            self.log.error(f'Failed to set current CPU count for {vm_name}')
-            return False
-        self.log.info(f'Successfully set current CPU count for {vm_name} to {cpu}')
-        return True
+        memory_kb = memory * 1024
+
+        def set_resources(root: ElementTree.Element) -> None:
+            if memory:
+                for tag in ('memory', 'currentMemory'):
+                    element = root.find(tag)
+                    if element is None:
+                        element = ElementTree.SubElement(root, tag)
+                    element.text = str(memory_kb)
+                    element.set('unit', 'KiB')
+            if cpu:
+                vcpu = root.find('vcpu')
+                if vcpu is None:
+                    vcpu = ElementTree.SubElement(root, 'vcpu')
+                vcpu.text = str(cpu)
+                vcpu.attrib.pop('current', None)
+
+        if self.__update_domain_xml(vm_name, set_resources):
+            if cpu:
+                self.log.info(f'Successfully set max and current CPU count for {vm_name} to {cpu}')
+            if memory:
+                self.log.info(f'Successfully set max and current memory for {vm_name} to {memory_kb} KiB')
+            return True
+        self.log.error(f'Failed to set resources for {vm_name}')
+        return False
 
     def __shutdown_vm_if_running(self, vm_name: str, force: bool = False) -> tuple:
         """Helper function to check if a VM is running and shutdown if it is. Will prompt the user to shutdown the VM
@@ -662,10 +954,11 @@ class KVMController(Utils):
             tuple: (bool, bool) state, running state
         """
         running = False
-        if vm_name in self.get_instances().get('running', []):
+        instances = self._get_instances_cached()
+        if vm_name in instances.get('running', []):
             running = True
             if force or input(f'VM {vm_name} is running. Shutdown? [y/n]: ').lower() == 'y':
-                if not self.shutdown_vm(vm_name):
+                if not self.shutdown_vm(vm_name, instances=instances):
                     return False, running
             else:
                 self.log.error(f'VM {vm_name} is running. Cannot change resources')
@@ -673,9 +966,10 @@ class KVMController(Utils):
         return True, running
 
     def _wait_for_vm_init(self, vm_name: str, max_wait: int = 120) -> str:
-        """Wait for a VM to initialize by checking the state of the VM every 5 seconds. If the VM is not initialized
-        after max_wait seconds, it will return False. When the VM is initialized, it will display the IP address
-        for interface 1 of the VM and return the IP address.
+        """Wait for a VM to initialize. Waits on the libvirt guest agent connected event, then checks for the IP
+        address with an exponential backoff (1ms doubling up to 1s) against a monotonic deadline. If the VM is not
+        initialized after max_wait seconds, it will return an empty string. When the VM is initialized, it will display
+        the IP address for interface 1 of the VM and return it.
 
         Args:
             vm_name (str): the name of the VM to wait for initialization
@@ -684,74 +978,122 @@ class KVMController(Utils):
         Returns:
             str: IP address of the VM or empty string if not found
         """
-        count = 0
-        while count < max_wait:
-            print(f'\rWaiting for VM {vm_name} to initialize. {count}/{max_wait} seconds', end='')
-            ip = self.__display_vm_is_up(vm_name)
-            if ip:
-                return ip
-            count += 5
-            sleep(5)
+        start = monotonic()
+        deadline = start + max_wait
+        connected = libvirt.VIR_CONNECT_DOMAIN_EVENT_AGENT_LIFECYCLE_STATE_CONNECTED
+        if self.__wait_for_domain_event(vm_name, libvirt.VIR_DOMAIN_EVENT_ID_AGENT_LIFECYCLE,
+                                        lambda state: state == connected, self.__agent_connected, max_wait,
+                                        'initialize'):
+            delay = POLL_DELAY_START
+            progress = sys.stdout.isatty()
+            while (now := monotonic()) < deadline:
+                if progress:
+                    print(f'\rWaiting for VM {vm_name} to initialize. {int(now - start)}/{max_wait} seconds', end='')
+                ip = self.__display_vm_is_up(vm_name)
+                if ip:
+                    return ip
+                sleep(max(0.0, min(delay, deadline - monotonic())))
+                delay = min(delay * 2, POLL_DELAY_MAX)
+            if progress:
+                print('')  # flush to new line on console
         self.log.error(f'Failed to wait for vm {vm_name} to initialize after {max_wait} seconds')
         return ''
 
-    def list_vms(self) -> bool:
-        """List all VMs on the hypervisor. This will display the VMs in JSON format.
+    def list_vms(self, detail: bool = False) -> bool:
+        """List all VMs on the hypervisor. This will display the VMs in JSON format. States come from the lifecycle
+        event cache so repeated redraws do not query libvirt again.
+
+        Args:
+            detail (bool, optional): include the state, disks and interfaces of every VM. Defaults to False.
 
         Returns:
             bool: True if successful, False otherwise
         """
-        return self.display_info_msg(f'VMs:\n{json.dumps(self.get_instances(True), indent=2)}')
+        if detail:
+            return self.display_info_msg(f'VMs:\n{json.dumps(self.get_instances_detail(), indent=2)}')
+        instances = {state: sorted(vms) for state, vms in self.get_instances().items()}
+        return self.display_info_msg(f'VMs:\n{json.dumps(instances, indent=2)}')
+
+    def get_instances_detail(self, names: list = None, max_workers: int = 16) -> dict:
+        """Get the state, disks and interfaces of VMs. Every VM is looked up independently so the disk and interface
+        queries are fanned out over a thread pool.
+
+        Args:
+            names (list, optional): VM names to get the details for. Defaults to None (all VMs).
+            max_workers (int, optional): max concurrent queries. Defaults to 16.
+
+        Returns:
+            dict: dictionary of VM names with a dict of state, disks and interfaces as the value
+        """
+        instances = self.get_instances(True)
+        states = {name: state for state, vms in instances.items() for name in vms}
+        names = sorted(states) if names is None else names
+        if not names:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(names) * 2)) as executor:
+            disks = {name: executor.submit(self.get_vm_disks, name) for name in names}
+            interfaces = {name: executor.submit(self.get_vm_interfaces, name) for name in names}
+            return {name: {
+                'state': states.get(name, ''),
+                'disks': disks[name].result(),
+                'interfaces': interfaces[name].result(),
+            } for name in names}
 
-    def delete_vm(self, vm_name: str, force: bool = False) -> bool:
+    def delete_vm(self, vm_name: str, force: bool = False, instances: dict = None) -> bool:
         """Delete a VM by shutting it down, undefine it, and deleting its directory. This will remove all traces of
         the VM from the hypervisor and the VM directory.
 
         Args:
             vm_name (str): The name of the VM to delete
             force (bool, optional): Force the delete without user input. Defaults to False.
+            instances (dict, optional): hypervisor instances the caller already has. Defaults to None.
 
         Returns:
             bool: True if successful, False otherwise
         """
         if force or input(f'Delete VM {vm_name} and all its data? [y/n]: ').lower() == 'y':
             self.log.info(f'Deleting VM {vm_name}')
-            instance = self.get_instances()
-            if self.__instance_exists(vm_name, instance):
-                if vm_name in instance.get('running', []):
-                    if not self.shutdown_vm(vm_name):
+            with self._instance_snapshot():
+                instance = instances or self._get_instances_cached()
+                if self.__instance_exists(vm_name, instance):
+                    if vm_name in instance.get('running', []):
+                        if not self.shutdown_vm(vm_name, instances=instance):
+                            return False
+                    if not self.__undefine_vm(vm_name):
                         return False
-                if not self.__undefine_vm(vm_name):
-                    return False
-            return self.__delete_vm_directory(vm_name)
+                self._invalidate_instances_cache()
+                return self.__delete_vm_directory(vm_name)
         return False
 
-    def shutdown_vm(self, vm_name: str, max_wait: int = 60) -> bool:
-        """Shutdown a VM using the virsh shutdown command. It will wait for the VM to shutdown for max_wait seconds
+    def shutdown_vm(self, vm_name: str, max_wait: int = 60, instances: dict = None) -> bool:
+        """Shutdown a VM using the libvirt shutdown call. It will wait for the VM to shutdown for max_wait seconds
         then force shutdown the VM if it is not shutdown.
 
         Args:
             vm_name (str): the name of the VM to shutdown
             max_wait (int, optional): the max wait time for VM shutdown. Defaults to 60 (1 min).
+            instances (dict, optional): hypervisor instances the caller already has. Defaults to None.
 
         Returns:
             bool: True if successful, False otherwise
         """
         self.log.info(f'Shutting down VM {vm_name}')
-        instances = self.get_instances()
+        if not instances:
+            instances = self._get_instances_cached()
         if not self.__instance_exists(vm_name, instances):
             self.log.error(f'VM {vm_name} does not exist')
             return False
         if vm_name not in instances.get('running', []):
             self.log.info(f'VM {vm_name} is not running')
             return True
-        if self._run_cmd(f'virsh shutdown {vm_name}')[1]:
+        self._invalidate_instances_cache()
+        if self.__domain_action(vm_name, 'shutdown'):
             return self.__wait_for_vm_shutdown(vm_name, max_wait)
         self.log.error(f'Failed to shutdown VM {vm_name}')
         return False
 
     def force_shutdown_vm(self, vm_name: str) -> bool:
-        """Force shutdown a VM by using the virsh destroy command. This is not a graceful shutdown and can cause data
+        """Force shutdown a VM by using the libvirt destroy call. This is not a graceful shutdown and can cause data
         loss.
 
         Args:
@@ -761,34 +1103,39 @@ class KVMController(Utils):
             bool: True if successful, False otherwise
         """
         self.log.info(f'Force shutting down VM {vm_name}')
-        if self._run_cmd(f'virsh destroy {vm_name}')[1]:
+        self._invalidate_instances_cache()
+        if self.__domain_action(vm_name, 'destroy'):
             return self.__wait_for_vm_shutdown(vm_name, 10, False)
         self.log.error(f'Failed to force shutdown VM {vm_name}')
         return False
 
-    def start_vm(self, vm_name: str, max_wait: int = 120) -> str:
-        """Start a VM using the virsh start command then wait for the VM to initialize and return the IP address.
+    def start_vm(self, vm_name: str, max_wait: int = 120, instances: dict = None) -> str:
+        """Start a VM using the libvirt create call then wait for the VM to initialize and return the IP address.
         It will wait a maximum of max_wait seconds for the VM to initialize before giving up.
 
         Args:
             vm_name (str): the name of the VM to start
             max_wait (int, optional): the max wait time for VM initialization. Defaults to 120 (2 mins).
+            instances (dict, optional): hypervisor instances the caller already has. Defaults to None.
 
         Returns:
             str: IP address of the VM or empty string if not found
         """
         self.log.info(f'Starting VM {vm_name}')
-        instances = self.get_instances()
-        if not self.__instance_exists(vm_name, instances):
-            self.log.error(f'VM {vm_name} does not exist')
+        with self._instance_snapshot():
+            if not instances:
+                instances = self._get_instances_cached()
+            if not self.__instance_exists(vm_name, instances):
+                self.log.error(f'VM {vm_name} does not exist')
+                return ''
+            if vm_name in instances.get('running', []):
+                self.log.info(f'VM {vm_name} is already running')
+                return True
+            self._invalidate_instances_cache()
+            if self.__domain_action(vm_name, 'create'):
+                return self._wait_for_vm_init(vm_name, max_wait)
+            self.log.error(f'Failed to start VM {vm_name}')
             return ''
-        if vm_name in instances.get('running', []):
-            self.log.info(f'VM {vm_name} is already running')
-            return True
-        if self._run_cmd(f'virsh start {vm_name}')[1]:
-            return self._wait_for_vm_init(vm_name, max_wait)
-        self.log.error(f'Failed to start VM {vm_name}')
-        return ''
 
     def soft_reset_vm(self, vm_name: str) -> bool:
         """Soft reset a VM by shutting it down gracefully and starting it back up. If the VM is not running,
@@ -801,78 +1148,94 @@ class KVMController(Utils):
             bool: True if successful, False otherwise
         """
         self.log.info(f'Soft resetting VM {vm_name}')
-        if self.shutdown_vm(vm_name):
-            return self.start_vm(vm_name)
+        with self._instance_snapshot():
+            if self.shutdown_vm(vm_name):
+                return self.start_vm(vm_name)
         self.log.error(f'Failed to soft reset VM {vm_name}')
         return False
 
-    def hard_reset_vm(self, vm_name: str) -> bool:
-        """Hard reset a VM by using the virsh reset command. This is not a graceful shutdown and can cause data loss.
+    def hard_reset_vm(self, vm_name: str, instances: dict = None) -> bool:
+        """Hard reset a VM by using the libvirt reset call. This is not a graceful shutdown and can cause data loss.
         If the VM is not running, it will be started.
 
         Args:
             vm_name (str): the vm name to hard reset
+            instances (dict, optional): hypervisor instances the caller already has. Defaults to None.
 
         Returns:
             bool: True if successful, False otherwise
         """
         self.log.info(f'Hard resetting VM {vm_name}')
-        instances = self.get_instances()
-        if not self.__instance_exists(vm_name, instances):
-            self.log.error(f'VM {vm_name} does not exist')
+        with self._instance_snapshot():
+            instances = instances or self._get_instances_cached()
+            if not self.__instance_exists(vm_name, instances):
+                self.log.error(f'VM {vm_name} does not exist')
+                return False
+            if vm_name not in instances.get('running', []):
+                self.log.info(f'VM {vm_name} is not running. Starting...')
+                return self.start_vm(vm_name, instances=instances)
+            if self.__domain_action(vm_name, 'reset', 0):
+                return self._wait_for_vm_init(vm_name)
+            self.log.error(f'Failed to hard reset VM {vm_name}')
             return False
-        if vm_name not in instances.get('running', []):
-            self.log.info(f'VM {vm_name} is not running. Starting...')
-            return self.start_vm(vm_name)
-        if self._run_cmd(f'virsh reset {vm_name}')[1]:
-            return self._wait_for_vm_init(vm_name)
-        self.log.error(f'Failed to hard reset VM {vm_name}')
-        return False
 
-    def reboot_vm(self, vm_name: str) -> bool:
-        """Reboot a VM by using the virsh reboot command. If the VM is not running, it will be started.
+    def reboot_vm(self, vm_name: str, instances: dict = None) -> bool:
+        """Reboot a VM by using the libvirt reboot call. If the VM is not running, it will be started.
 
         Args:
             vm_name (str): the name of the VM to reboot
+            instances (dict, optional): hypervisor instances the caller already has. Defaults to None.
 
         Returns:
             bool: True if successful, False otherwise
         """
         self.log.info(f'Rebooting VM {vm_name}')
-        instances = self.get_instances()
-        if not self.__instance_exists(vm_name, instances):
-            self.log.error(f'VM {vm_name} does not exist')
+        with self._instance_snapshot():
+            instances = instances or self._get_instances_cached()
+            if not self.__instance_exists(vm_name, instances):
+                self.log.error(f'VM {vm_name} does not exist')
+                return False
+            if vm_name not in instances.get('running', []):
+                self.log.info(f'VM {vm_name} is not running. Starting...')
+                return self.start_vm(vm_name, instances=instances)
+            if self.__domain_action(vm_name, 'reboot', 0):
+                return self._wait_for_vm_init(vm_name)
+            self.log.error(f'Failed to reboot VM {vm_name}')
             return False
-        if vm_name not in instances.get('running', []):
-            self.log.info(f'VM {vm_name} is not running. Starting...')
-            return self.start_vm(vm_name)
-        if self._run_cmd(f'virsh reboot {vm_name}')[1]:
-            return self._wait_for_vm_init(vm_name)
-        self.log.error(f'Failed to reboot VM {vm_name}')
-        return False
 
-    def purge_vms(self, force: bool = False) -> bool:
-        """Purge VM images and delete all images for non running VMs.
+    def purge_vms(self, force: bool = False, max_workers: int = 16) -> bool:
+        """Purge VM images and delete all images for non running VMs. The VMs are independent so they are deleted
+        concurrently and pending deletes are cancelled on the first failure. The instances are listed once and shared
+        with every delete.
 
         Args:
             force (bool, optional): Force the purge without user input. Defaults to False.
+            max_workers (int, optional): max VMs to delete at the same time. Defaults to 16.
 
         Returns:
             bool: True if successful, False otherwise
         """
         if force or input('Purge VMs and delete all instances for non running VMs? [y/n]: ').lower() == 'y':
-            running_instances = self.__get_running_instances()
-            for vm in Path(self.vm_dir).iterdir():
-                if vm.name in running_instances:
-                    continue
-                if not self.delete_vm(vm.name):
-                    self.log.error(f'Failed to delete VM {vm.name}')
-                    return False
+            instances = self.get_instances()
+            running_instances = set(instances['running'])
+            vms = [vm.name for vm in Path(self.vm_dir).iterdir() if vm.name not in running_instances]
+            if not vms:
+                return True
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(vms))) as executor:
+                futures = {executor.submit(self.delete_vm, vm, True, instances): vm for vm in vms}
+                for future in as_completed(futures):
+                    if not future.result():
+                        self.log.error(f'Failed to delete VM {futures[future]}')
+                        for pending in futures:
+                            pending.cancel()
+                        return False
             return True
         return False
 
     def get_instances(self, sort: bool = False) -> dict:
-        """Get all instances on the hypervisor. This will return a dictionary of instances with the state as the key
+        """Get all instances on the hypervisor. This will return a dictionary of instances with the state as the key.
+        States are read from the cache kept current by libvirt lifecycle events, so only the first call on a
+        connection lists the domains.
 
         Args:
             sort (bool, optional): option to sort the VMs within their state key. Defaults to False.
@@ -881,23 +1244,21 @@ class KVMController(Utils):
             dict: dictionary of instances with the state as the key and a list of VM names as the value
         """
         instances = {'running': [], 'stopped': [], 'paused': []}
-        rsp = self._run_cmd('virsh list --all')
-        if rsp[1]:
-            for line in rsp[0].splitlines():
-                if 'running' in line:
-                    instances['running'].append(line.split()[1])
-                elif 'shut off' in line:
-                    instances['stopped'].append(line.split()[1])
-                elif 'paused' in line:
-                    instances['paused'].append(line.split()[1])
+        try:
+            for name, state in _get_domain_states(self._conn).items():
+                bucket = instances.get(state)
+                if bucket is not None:
+                    bucket.append(name)
+        except libvirt.libvirtError:
+            self.log.exception('Failed to list instances')
         if sort:
-            instances['running'].sort()
-            instances['stopped'].sort()
-            instances['paused'].sort()
+            for vms in instances.values():
+                vms.sort()
         return instances
 
     def is_vm_running(self, vm_name: str) -> bool:
-        """Check if a VM is running using the virsh dominfo command.
+        """Check if a VM is running using the active instance snapshot, or the lifecycle event cache when there is no
+        snapshot.
 
         Args:
             vm_name (str): name of the vm to check if it is running
@@ -905,10 +1266,12 @@ class KVMController(Utils):
         Returns:
             bool: True if the VM is running, False otherwise
         """
-        return self.__get_vm_state(vm_name) == 'running'
+        instances = self._snapshot.instances or self.get_instances()
+        return vm_name in instances.get('running', [])
 
     def is_vm_stopped(self, vm_name: str) -> bool:
-        """Check if a VM is stopped using the virsh dominfo command.
+        """Check if a VM is stopped using the active instance snapshot, or the lifecycle event cache when there is no
+        snapshot.
 
         Args:
             vm_name (str): name of the vm to check if it is stopped
@@ -916,10 +1279,12 @@ class KVMController(Utils):
         Returns:
             bool: True if the VM is stopped, False otherwise
         """
-        return self.__get_vm_state(vm_name) == 'shut off'
+        instances = self._snapshot.instances or self.get_instances()
+        return vm_name in instances.get('stopped', [])
 
     def is_vm_paused(self, vm_name: str) -> bool:
-        """Check if a VM is paused using the virsh dominfo command.
+        """Check if a VM is paused using the active instance snapshot, or the lifecycle event cache when there is no
+        snapshot.
 
         Args:
             vm_name (str): name of the vm to check if it is paused
@@ -927,7 +1292,8 @@ class KVMController(Utils):
         Returns:
             bool: True if the VM is paused, False otherwise
         """
-        return self.__get_vm_state(vm_name) == 'paused'
+        instances = self._snapshot.instances or self.get_instances()
+        return vm_name in instances.get('paused', [])
 
     def get_running_instances(self) -> list:
         """Get all running instances on the hypervisor.
@@ -953,9 +1319,46 @@ class KVMController(Utils):
         """
         return self.get_instances().get('paused', [])
 
+    def __get_disk_capacity(self, dom: libvirt.virDomain, disk_name: str) -> int:
+        """Get the capacity of a VM disk from libvirt blockInfo
+
+        Args:
+            dom (libvirt.virDomain): domain the disk is attached to
+            disk_name (str): target or path of the disk to get the capacity for
+
+        Returns:
+            int: disk capacity in bytes or 0 if not found
+        """
+        try:
+            return dom.blockInfo(disk_name)[0]
+        except libvirt.libvirtError:
+            self.log.exception(f'Failed to get disk capacity for {disk_name} on {dom.name()}')
+        return 0
+
+    def __get_disk_capacities(self, dom: libvirt.virDomain) -> dict:
+        """Get the capacity of every disk of a VM with one block stats request instead of a blockInfo call per disk.
+        libvirt probes the image files for VMs that are not running so this works for stopped VMs as well.
+
+        Args:
+            dom (libvirt.virDomain): domain to get the disk capacities for
+
+        Returns:
+            dict: disk target (ex: sda) to capacity in bytes, empty if the stats could not be read
+        """
+        try:
+            stats = self._conn.domainListGetStats([dom], libvirt.VIR_DOMAIN_STATS_BLOCK)[0][1]
+        except (libvirt.libvirtError, IndexError):
+            self.log.exception(f'Failed to get block stats for {dom.name()}')
+            return {}
+        capacities = {}
+        for index in range(stats.get('block.count', 0)):
+            capacity = stats.get(f'block.{index}.capacity')
+            if capacity is not None:
+                capacities[stats.get(f'block.{index}.name')] = capacity
+        return capacities
+
     def get_vm_disk_capacity(self, vm_name: str, disk_name: str) -> int:
-        """Get the disk capacity of a VM using the virsh domblkinfo command. This will return the disk capacity in
-        bytes.
+        """Get the disk capacity of a VM using libvirt blockInfo. This will return the disk capacity in bytes.
 
         Args:
             vm_name (str): name of the vm to get the disk capacity for
@@ -964,21 +1367,15 @@ class KVMController(Utils):
         Returns:
             int: disk capacity in bytes or 0 if not found
         """
-        rsp = self._run_cmd(f'virsh domblkinfo {vm_name} {disk_name}')
-        if rsp[1]:
-            for line in rsp[0].splitlines():
-                if 'Capacity:' in line:
-                    try:
-                        return int(line.split(':')[-1].strip())
-                    except Exception:
-                        self.log.exception(f'Failed to convert disk capacity to int for {disk_name} on {vm_name}')
-                        return 0
-        self.log.error(f'Failed to get disk capacity for {disk_name} on {vm_name}')
-        return 0
+        dom = self.__get_domain(vm_name)
+        if dom is None:
+            return 0
+        return self.__get_disk_capacity(dom, disk_name)
 
     def get_vm_disks(self, vm_name: str) -> dict:
-        """Get the disks attached to a VM using the virsh domblklist command. It will return a dictionary of disks with
-        target as the key and a dict of location, serial, and size as the value.
+        """Get the disks attached to a VM from the libvirt domain XML. It will return a dictionary of disks with
+        target as the key and a dict of location, serial, and size as the value. Sizes for all disks come from a single
+        block stats request.
 
         Args:
             vm_name (str): name of the vm to get the disks for
@@ -987,27 +1384,65 @@ class KVMController(Utils):
             dict: dictionary of disks with the target as the key and the source as the value
         """
         disks = {}
-        rsp = self._run_cmd(f'virsh domblklist {vm_name}')
-        if rsp[1]:
-            for line in rsp[0].splitlines():
-                if '/' in line:
-                    info = line.split()
-                    size = self.get_vm_disk_capacity(vm_name, info[0])
-                    disks[info[0]] = {
-                        'location': info[1],
-                        'serial': f'{vm_name}-{info[1].split("/")[-1].split(".")[0]}',
-                        'size_bytes': size,
-                        'size': self.__bytes_to_human_readable(size),
-                    }
+        dom = self.__get_domain(vm_name)
+        if dom is None:
+            return disks
+        try:
+            root = ElementTree.fromstring(dom.XMLDesc(0))
+        except libvirt.libvirtError:
+            self.log.exception(f'Failed to get disks for {vm_name}')
+            return disks
+        capacities = self.__get_disk_capacities(dom)
+        for disk in root.findall('.//devices/disk'):
+            source = disk.find('source')
+            target = disk.find('target')
+            if source is None or target is None or not source.get('file'):
+                continue
+            location = source.get('file')
+            size = capacities.get(target.get('dev'))
+            if size is None:
+                size = self.__get_disk_capacity(dom, target.get('dev'))
+            disks[target.get('dev')] = {
+                'location': location,
+                'serial': f'{vm_name}-{_disk_stem(location)}',
+                'size_bytes': size,
+                'size': self.__bytes_to_human_readable(size),
+            }
         return disks
 
-    def eject_instance_iso(self, vm_name: str, remove_cdrom: bool = True) -> bool:
-        """Eject the attached ISO from a VM using the virsh change-media command. This will eject the ISO from the VM
+    def __eject_media(self, vm_name: str, target: str) -> bool:
+        """Eject the media of a CDROM device in the persistent VM config using libvirt updateDeviceFlags
+
+        Args:
+            vm_name (str): name of the vm to eject the media from
+            target (str): target of the CDROM device (ex: sda)
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        dom = self.__get_domain(vm_name)
+        if dom is None:
+            return False
+        try:
+            disk = self.__get_disk_element(dom, target, libvirt.VIR_DOMAIN_XML_INACTIVE)
+            if disk is not None:
+                source = disk.find('source')
+                if source is not None:
+                    disk.remove(source)
+                dom.updateDeviceFlags(ElementTree.tostring(disk, encoding='unicode'), libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+                return True
+        except libvirt.libvirtError:
+            self.log.exception(f'Failed to eject media {target} from {vm_name}')
+        return False
+
+    def eject_instance_iso(self, vm_name: str, remove_cdrom: bool = True, instances: dict = None) -> bool:
+        """Eject the attached ISO from a VM using libvirt updateDeviceFlags. This will eject the ISO from the VM
         and remove the CDROM device from the VM if specified.
 
         Args:
             vm_name (str): name of the vm to eject the ISO from
             remove_cdrom (bool, optional): option to delete cdrom device from VM after being ejected. Defaults to True.
+            instances (dict, optional): hypervisor instances the caller already holds. Defaults to None.
 
         Returns:
             bool: True if successful, False otherwise
@@ -1015,10 +1450,10 @@ class KVMController(Utils):
         disks: dict = self.get_vm_disks(vm_name)
         for target, source in disks.items():
             if source.get('location', '').endswith('.iso'):
-                if self._run_cmd(f'virsh change-media {vm_name} {target} --eject --config')[1]:
+                if self.__eject_media(vm_name, target):
                     self.log.info(f'Ejected {source.get("location")} from {vm_name}')
                     if remove_cdrom:
-                        return self.__remove_instance_cdrom(vm_name, target)
+                        return self.__remove_instance_cdrom(vm_name, target, instances)
                     return True
         self.log.error(f'Failed to remove attached iso from {vm_name}')
         return False
@@ -1039,10 +1474,10 @@ class KVMController(Utils):
         """
         disk_name = self.__create_data_disk(vm_name, size, name)
         if disk_name:
-            vms = self.get_instances()
+            vms = self._get_instances_cached()
             if self.__attach_data_disk(vm_name, disk_name, vms):
                 if vm_name in vms.get('running', []):
-                    device_name = disk_name.split('/')[-1].split('.')[0]
+                    device_name = _disk_stem(disk_name)
                     mount = mount if mount != 'default' else f'/mnt/{device_name}'
                     ip = self.get_vm_ip_by_index(vm_name)
                     if ip:
@@ -1058,8 +1493,9 @@ class KVMController(Utils):
         return False
 
     def get_vm_interfaces(self, vm_name: str) -> dict:
-        """Get the interfaces attached to a VM using the virsh guestinfo command. It will return a dictionary of
-        VM interfaces with the interface number as the key and a dict of name, mac, ip, and subnet as the value.
+        """Get the interfaces of a VM from the qemu guest agent using libvirt interfaceAddresses. It will return a
+        dictionary of VM interfaces with the interface number as the key and a dict of name, mac, ip, and subnet as
+        the value.
 
         Args:
             vm_name (str): name of the vm to get the interfaces for
@@ -1068,24 +1504,19 @@ class KVMController(Utils):
             dict: vm interfaces dict
         """
         interfaces = {}
-        rsp = self._run_cmd(f'virsh guestinfo {vm_name}', True)
-        if rsp[1]:
-            for line in rsp[0].splitlines():
-                if line.startswith('if.'):
-                    if line.startswith('if.count'):
-                        continue
-                    key, _, value = line.split()
-                    num = key.split('.')[1]
-                    if num not in interfaces:
-                        interfaces[num] = {}
-                    if 'name' in key:
-                        interfaces[num]['name'] = value
-                    elif 'hwaddr' in key:
-                        interfaces[num]['mac'] = value
-                    elif '0.addr' in key:
-                        interfaces[num]['ip'] = value
-                    elif '0.prefix' in key:
-                        interfaces[num]['subnet'] = '/' + value
+        try:
+            dom = self._conn.lookupByName(vm_name)
+            addresses = dom.interfaceAddresses(libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_AGENT)
+        except libvirt.libvirtError:
+            return interfaces
+        for num, (name, data) in enumerate(addresses.items()):
+            interface = {'name': name}
+            if data.get('hwaddr'):
+                interface['mac'] = data['hwaddr']
+            if data.get('addrs'):
+                interface['ip'] = data['addrs'][0]['addr']
+                interface['subnet'] = f'/{data["addrs"][0]["prefix"]}'
+            interfaces[str(num)] = interface
         return interfaces
 
     def get_eth_interfaces(self, vm_name: str) -> dict:
@@ -1105,8 +1536,8 @@ class KVMController(Utils):
         return eth
 
     def display_vm_interfaces(self, vm_name: str, instances: dict = None) -> str:
-        """Display the interfaces of a VM. If the VM Is powered on then it uses the virsh guestinfo command. If
-        the VM is powered off then it uses the virsh dumpxml command to get the interfaces. Info is displayed in JSON
+        """Display the interfaces of a VM. If the VM Is powered on then it uses the qemu guest agent. If
+        the VM is powered off then it uses the libvirt domain XML to get the interfaces. Info is displayed in JSON
 
         Args:
             vm_name (str): name of the vm to get the interfaces for
@@ -1116,13 +1547,13 @@ class KVMController(Utils):
             str: JSON formatted string of the VM interfaces
         """
         if not instances:
-            instances = self.get_instances()
+            instances = self._get_instances_cached()
         if vm_name in instances.get('running', []):
             return self.display_info_msg(json.dumps(self.get_eth_interfaces(vm_name), indent=2))
         return self.display_info_msg(json.dumps(self.__get_shutdown_vm_interfaces(vm_name), indent=2))
 
     def get_vm_ip_by_index(self, vm_name: str, network_index: int = 1) -> str:
-        """Get the IP address of a VM using the virsh guestinfo command. This will return the IP address of the VM
+        """Get the IP address of a VM reported by the qemu guest agent. This will return the IP address of the VM
         for the specified network index. If the IP address is not found, it will return None.
 
         Args:
@@ -1137,10 +1568,31 @@ class KVMController(Utils):
             return interfaces[str(network_index)].get('ip', '')
         return ''
 
+    def __wait_for_interface_ip(self, vm_name: str, network_index: int, max_wait: int = 15) -> str:
+        """Wait for a VM interface to get an IP address. Checks with an exponential backoff (1ms doubling up to 1s)
+        so it returns as soon as the guest agent reports the address instead of always waiting max_wait seconds.
+
+        Args:
+            vm_name (str): name of the vm the interface is attached to
+            network_index (int): network index of the interface, starting at 1
+            max_wait (int, optional): max seconds to wait for the IP address. Defaults to 15.
+
+        Returns:
+            str: IP address of the interface or empty string if none was assigned in time
+        """
+        deadline = monotonic() + max_wait
+        delay = POLL_DELAY_START
+        while True:
+            ip = self.get_vm_ip_by_index(vm_name, network_index)
+            remaining = deadline - monotonic()
+            if ip or remaining <= 0:
+                return ip
+            sleep(min(delay, remaining))
+            delay = min(delay * 2, POLL_DELAY_MAX)
+
     def add_network_interface(self, vm_name: str) -> bool:
-        """Attach a network interface to a VM using the virsh attach-device command. It creates an xml config file
-        to add the network device to the VM. It will delete the config file after the device is added. It wait for
-        the VM to populate the IP address (~15 seconds) before displaying the interface data if the VM is powered on.
+        """Attach a network interface to a VM using libvirt attachDeviceFlags. If the VM is powered on it waits up to
+        15 seconds for the new interface to get an IP address before displaying the interface data.
         Displays the interface data after the device is added.
 
         Args:
@@ -1149,24 +1601,21 @@ class KVMController(Utils):
         Returns:
             bool: True if successful, False otherwise
         """
-        instances = self.get_instances()
+        instances = self._get_instances_cached()
         if not self.__instance_exists(vm_name, instances):
             self.log.error(f'VM {vm_name} does not exist')
             return False
-        network_file = self.__create_add_network_file(vm_name)
-        if network_file and self.__attach_device(vm_name, network_file, instances):
-            if self.__remove_config_file(network_file):
-                if vm_name in instances.get('running', []):
-                    sleep(15)  # give time for IP address to populate
-                self.log.info(f'Successfully attached network interface to {vm_name}')
-                return self.display_vm_interfaces(vm_name, instances)
+        if self.__attach_device(vm_name, NEW_NETWORK_XML, instances):
+            if vm_name in instances.get('running', []):
+                self.__wait_for_interface_ip(vm_name, len(self.__get_shutdown_vm_interfaces(vm_name)))
+            self.log.info(f'Successfully attached network interface to {vm_name}')
+            return self.display_vm_interfaces(vm_name, instances)
         self.log.error(f'Failed to attach network interface to {vm_name}')
         return False
 
     def remove_network_interface(self, vm_name: str, mac: str) -> bool:
-        """Detach a network interface from a VM using the virsh detach-device command. It creates an xml config file
-        to remove the network device from the VM. It will delete the config file after the device is removed.
-        Displays the interface data after the device is removed.
+        """Detach a network interface from a VM using libvirt detachDeviceFlags. Displays the interface data after the
+        device is removed.
 
         Args:
             vm_name (str): _description_
@@ -1175,20 +1624,18 @@ class KVMController(Utils):
         Returns:
             bool: _description_
         """
-        instances = self.get_instances()
+        instances = self._get_instances_cached()
         if not self.__instance_exists(vm_name, instances):
             self.log.error(f'VM {vm_name} does not exist')
             return False
-        network_file = self.__create_remove_network_file(vm_name, mac)
-        if network_file and self.__detach_device(vm_name, network_file, instances):
-            if self.__remove_config_file(network_file):
-                self.log.info(f'Successfully removed network interface from {vm_name}')
-                return self.display_vm_interfaces(vm_name, instances)
+        if self.__detach_device(vm_name, REMOVE_NETWORK_XML.format(mac=mac), instances):
+            self.log.info(f'Successfully removed network interface from {vm_name}')
+            return self.display_vm_interfaces(vm_name, instances)
         self.log.error(f'Failed to attach network interface to {vm_name}')
         return False
 
     def display_vm_disks(self, vm_name: str) -> bool:
-        """Display the disks attached to a VM using the virsh domblklist command. Data is displayed in JSON format.
+        """Display the disks attached to a VM from the libvirt domain XML. Data is displayed in JSON format.
 
         Args:
             vm_name (str): name of the vm get the disks for
@@ -1213,7 +1660,7 @@ class KVMController(Utils):
             return False
         disks = self.get_vm_disks(vm_name)
         if device in disks:
-            if vm_name in self.get_instances().get('running', []):
+            if vm_name in self._get_instances_cached().get('running', []):
                 return self.__unmount_system_disk(vm_name, device, disks)
             self.log.error(f'VM {vm_name} is not running')
         else:
@@ -1236,9 +1683,9 @@ class KVMController(Utils):
             return False
         disks = self.get_vm_disks(vm_name)
         if device in disks:
-            device_name = disks[device].get('location', '').split("/")[-1].split(".")[0]
+            device_name = _disk_stem(disks[device].get('location', ''))
             mount = mount if mount != 'default' else f'/mnt/{device_name}'
-            if vm_name in self.get_instances().get('running', []):
+            if vm_name in self._get_instances_cached().get('running', []):
                 return self.__mount_system_disk(vm_name, device_name + '-part1', mount)
             self.log.error(f'VM {vm_name} is not running')
         else:
@@ -1246,8 +1693,7 @@ class KVMController(Utils):
         return False
 
     def remove_data_disk(self, vm_name: str, device: str, force: bool = False):
-        """Remove a data disk from a VM using the virsh detach-device command. It creates an xml config file to remove
-        the device then, removes the disk then deletes the config file. Deletes the physical disk if force is True or
+        """Remove a data disk from a VM using libvirt detachDeviceFlags. Deletes the physical disk if force is True or
         prompted by the user.
 
         Args:
@@ -1264,7 +1710,7 @@ class KVMController(Utils):
             return False
         disks = self.get_vm_disks(vm_name)
         if device in disks:
-            vms = self.get_instances()
+            vms = self._get_instances_cached()
             if vm_name in vms.get('running', []):
                 if not self.__unmount_system_disk(vm_name, device, disks):
                     return False
@@ -1290,7 +1736,7 @@ class KVMController(Utils):
         """
         if self.__validate_disk_change(vm_name, force):
             size_bytes = self.__convert_size_to_bytes(size)
-            if size_bytes and self._run_cmd(f'qemu-img resize {device} {size_bytes}')[1]:
+            if size_bytes and self._run_cmd(['qemu-img', 'resize', device, str(size_bytes)])[1]:
                 self.log.info(f'Successfully set disk {device} to {size}')
                 return True
             self.log.error(f'Failed to increase disk {device}')
@@ -1309,23 +1755,24 @@ class KVMController(Utils):
         Returns:
             bool: True if successful, False otherwise
         """
-        disks = self.get_vm_disks(vm_name)
-        if device in disks:
-            if self.__increase_disk_size(vm_name, disks[device]["location"], size, force):
-                ip = self.start_vm(vm_name)
-                if ip:
-                    suffix = '-part1' if device != 'sda' else ''
-                    device_name = f'{vm_name}-{disks[device]["location"].split("/")[-1].split(".")[0]}{suffix}'
-                    if self.run_ansible_playbook(ip, vm_name, 'resize_disk.yml', {'device_name': device_name}):
-                        self.log.info(f'Successfully resized disk {device} on {vm_name}')
-                        return True
-                    self.log.error(f'Failed to resize disk {device} on {vm_name}')
-        else:
-            self.log.error(f'Disk {device} not found on {vm_name}')
-        return False
+        with self._instance_snapshot():
+            disks = self.get_vm_disks(vm_name)
+            if device in disks:
+                if self.__increase_disk_size(vm_name, disks[device]["location"], size, force):
+                    ip = self.start_vm(vm_name)
+                    if ip:
+                        suffix = '-part1' if device != 'sda' else ''
+                        device_name = f'{vm_name}-{_disk_stem(disks[device]["location"])}{suffix}'
+                        if self.run_ansible_playbook(ip, vm_name, 'resize_disk.yml', {'device_name': device_name}):
+                            self.log.info(f'Successfully resized disk {device} on {vm_name}')
+                            return True
+                        self.log.error(f'Failed to resize disk {device} on {vm_name}')
+            else:
+                self.log.error(f'Disk {device} not found on {vm_name}')
+            return False
 
     def get_vm_resources(self, vm_name: str) -> dict:
-        """Get the resources of a VM using the virsh dominfo command. This will return a dictionary of resources
+        """Get the resources of a VM using libvirt domain info. This will return a dictionary of resources
         with the name as the key and the value as the value.
 
         Args:
@@ -1335,15 +1782,17 @@ class KVMController(Utils):
             dict: dictionary of resources with the name as the key and the value as the value
         """
         resources = {}
-        rsp = self._run_cmd(f'virsh domstats {vm_name}')
-        if rsp[1]:
-            for line in rsp[0].splitlines():
-                if 'vcpu.current=' in line:
-                    resources['cpu'] = int(line.split('=')[-1].strip())
-                if 'balloon.current=' in line:
-                    size = self.__convert_size_to_bytes(line.split('=')[-1].strip() + 'kb')
-                    resources['memory_bytes'] = size
-                    resources['memory'] = self.__bytes_to_human_readable(size)
+        dom = self.__get_domain(vm_name)
+        if dom is not None:
+            try:
+                _, _, memory_kb, cpu, _ = dom.info()
+            except libvirt.libvirtError:
+                self.log.exception(f'Failed to get resources for {vm_name}')
+                return resources
+            size = memory_kb * 1024
+            resources['cpu'] = cpu
+            resources['memory_bytes'] = size
+            resources['memory'] = self.__bytes_to_human_readable(size)
         return resources
 
     def display_resources(self, vm_name: str) -> bool:
@@ -1358,7 +1807,7 @@ class KVMController(Utils):
         return self.display_info_msg(json.dumps(self.get_vm_resources(vm_name), indent=2))
 
     def set_vm_resources(self, vm_name: str, cpu: int = 0, memory: int = 0, force: bool = False) -> bool:
-        """Set the CPU and memory resources of a VM using the virsh setvcpus and virsh setmem commands. VM
+        """Set the CPU and memory resources of a VM with one update of its persistent domain XML. VM
         needs to be powered off to update these resources so it will check if the VM is running and shutdown.
         The VM will be powered back on after the resources are set.
 
@@ -1371,13 +1820,14 @@ class KVMController(Utils):
         Returns:
             bool: True if successful, False otherwise
         """
-        state, running = self.__shutdown_vm_if_running(vm_name, force)
-        if state:
-            updated = False
-            if self.__set_vm_cpu(vm_name, cpu) and self.__set_vm_memory(vm_name, memory):
-                self.log.info(f'Successfully set resources for {vm_name}')
-                updated = True
-            if running and not self.start_vm(vm_name):
-                return False
-            return updated
-        return False
+        with self._instance_snapshot():
+            state, running = self.__shutdown_vm_if_running(vm_name, force)
+            if state:
+                updated = False
+                if self.__set_vm_cpu_memory(vm_name, cpu, memory):
+                    self.log.info(f'Successfully set resources for {vm_name}')
+                    updated = True
+                if running and not self.start_vm(vm_name):
+                    return False
+                return updated
+            return False
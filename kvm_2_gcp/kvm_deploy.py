@@ -2,7 +2,7 @@ import getpass
 from pathlib import Path
 from uuid import uuid4
 from logging import Logger
-from shutil import copy2
+from shutil import copy2, rmtree
 
 from yaml import safe_load, safe_dump
 
@@ -72,23 +72,25 @@ class KVMDeploy(Utils):
         return f'{self.__deploy_dir}/cidata.iso'
 
     @property
-    def __create_cmd(self) -> str:
+    def __create_cmd(self) -> list:
         """Create the virt-install command to deploy the VM
 
         Returns:
-            str: command to run to create the VM
+            list: command arguments to run to create the VM
         """
-        return f'''virt-install \
---name={self._name} \
---os-variant=linux2022 \
---ram={self.__memory} \
---vcpus={self.__cpu} \
---import \
---disk path={self.__boot_disk},bus=scsi,serial={self._name}-boot,target=sda \
---disk path={self.__iso_file},device=cdrom,bus=scsi,serial={self._name}-cdrom,target=sdb \
---network bridge=virbr0,model=virtio \
---graphics vnc,listen=0.0.0.0 \
---noautoconsole'''
+        return [
+            'virt-install',
+            f'--name={self._name}',
+            '--os-variant=linux2022',
+            f'--ram={self.__memory}',
+            f'--vcpus={self.__cpu}',
+            '--import',
+            '--disk', f'path={self.__boot_disk},bus=scsi,serial={self._name}-boot,target=sda',
+            '--disk', f'path={self.__iso_file},device=cdrom,bus=scsi,serial={self._name}-cdrom,target=sdb',
+            '--network', 'bridge=virbr0,model=virtio',
+            '--graphics', 'vnc,listen=0.0.0.0',
+            '--noautoconsole'
+        ]
 
     def __create_user_cidata(self, user: str, public_key: str) -> dict:
         """Create the user data for the VM. Adds the users public key so they can ssh. Sets the user to sudo without
@@ -251,10 +253,8 @@ class KVMDeploy(Utils):
         Returns:
             bool: True if the ISO file was created, False otherwise
         """
-        contents = []
-        for file in self.__deploy_dir.glob('iso/*'):
-            contents.append(f'{self.__deploy_dir}/iso/{file.name}')
-        return self._run_cmd(f'genisoimage -output {self.__iso_file} -V cidata -r -J {" ".join(contents)}')[1]
+        contents = [f'{self.__deploy_dir}/iso/{file.name}' for file in self.__deploy_dir.glob('iso/*')]
+        return self._run_cmd(['genisoimage', '-output', self.__iso_file, '-V', 'cidata', '-r', '-J', *contents])[1]
 
     def __create_vm_boot_disk(self) -> bool:
         """Copies the image file to the VM directory and sets the disk size.
@@ -283,7 +283,14 @@ class KVMDeploy(Utils):
             bool: True if the cleanup was successful, False otherwise
         """
         for delete in ['cidata.iso', 'iso']:
-            if not self._run_cmd(f'rm -rf {self.__deploy_dir}/{delete}')[1]:
+            path = Path(f'{self.__deploy_dir}/{delete}')
+            try:
+                if path.is_dir():
+                    rmtree(path)
+                else:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                self.log.exception(f'Failed to delete {path}')
                 return False
         return True
 
@@ -310,7 +317,7 @@ class KVMDeploy(Utils):
         """
         if self._run_cmd(self.__create_cmd)[1]:
             ip = self.controller._wait_for_vm_init(self._name)
-            if ip and self.is_port_open(ip) and self.run_ansible_playbook(ip, self._name, self._playbook):
+            if ip and self.run_ansible_playbook(ip, self._name, self._playbook, port_attempts=12):
                 if self.controller.eject_instance_iso(self._name, True):
                     return self.__cleanup_iso_data() and self.__display_vm_info(ip)
         return False
@@ -4,6 +4,7 @@ from hashlib import sha256
 from logging import Logger
 from pathlib import Path
 from os import remove
+from uuid import uuid4
 
 import requests
 from bs4 import BeautifulSoup
@@ -451,14 +452,15 @@ class UbuntuImages(RemoteImage):
 
 
 class GCPImages(GCPController):
-    def __init__(self, project_id: str = 'default'):
+    def __init__(self, project_id: str = 'default', logger: Logger = None):
         """GCP remote image handler. Pulls repo data to cache locally
 
         Args:
             project_id (str): GCP project ID to use for image operations. Defaults to 'default'.
+            logger (Logger, optional): logger to use. Defaults to None.
         """
-        super().__init__()
-        self.project_id = project_id if project_id != 'default' else self._load_default_project_id()
+        super().__init__(logger=logger)
+        self.project_id = self._resolve_project_id(project_id)
 
     @property
     def public_image_info(self) -> dict:
@@ -541,7 +543,7 @@ class GCPImages(GCPController):
         Returns:
             compute_v1.Image: latest image object or None if not found
         """
-        return self.image_client.get_from_family(project=self.project_id, family=family_name)
+        return self._retry(self.image_client.get_from_family, project=self.project_id, family=family_name)
 
     def get_image(self, image_name: str) -> compute_v1.Image | None:
         """Get image by name.
@@ -552,7 +554,7 @@ class GCPImages(GCPController):
         Returns:
             compute_v1.Image: image object or None if not found
         """
-        return self.image_client.get(project=self.project_id, image=image_name)
+        return self._retry(self.image_client.get, project=self.project_id, image=image_name)
 
     def list_images_from_family(self, family: str, refresh: bool = False) -> list:
         """List images from family. It will check if the cache file exists and load it. If the cache file does not exits
@@ -569,7 +571,7 @@ class GCPImages(GCPController):
         cache_file = Path(f'{self.image_dir}/{family}_cache.json')
         if refresh or not cache_file.exists():
             images = []
-            for image in self.image_client.list(project=self.project_id):
+            for image in self._retry(self.image_client.list, project=self.project_id):
                 if image.family and image.family.startswith(family):
                     images.append(image.name)
             if images:
@@ -631,9 +633,10 @@ class GCPImages(GCPController):
         image = self.__create_image_obj(zone, vm_name, image_name, family)
         if image and self.image_client is not None:
             try:
-                operation = self.image_client.insert(project=self.project_id, image_resource=image)
+                operation = self._retry(self.image_client.insert, project=self.project_id, image_resource=image,
+                                        request_id=str(uuid4()))
             except Exception:
                 self.log.exception('Failed to create GCP image')
                 return False
-            return self._wait_for_global_operation(operation)
+            return self._wait_for_operation(operation)
         return False
@@ -1,10 +1,16 @@
 import json
 import pickle
 import socket
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from logging import Logger
 from subprocess import run
 from pathlib import Path
+from shlex import join
+from shutil import rmtree, which
+from threading import Lock
 from time import sleep
+from typing import Callable
 
 import ansible_runner
 from google.oauth2 import service_account
@@ -14,6 +20,26 @@ from kvm_2_gcp.color import Color
 from kvm_2_gcp.encrypt import Cipher
 
 
+_CREDENTIALS: dict[tuple[str, int], tuple[service_account.Credentials, str]] = {}
+_CREDENTIALS_LOCK = Lock()
+_CLIENTS: dict[tuple[type, str], object] = {}
+_CLIENTS_LOCK = Lock()
+
+
+@lru_cache(maxsize=8)
+def _list_playbooks(directory: str, mtime_ns: int) -> tuple[str, ...]:
+    """List the playbook names in a directory once per directory modification time
+
+    Args:
+        directory (str): directory to list
+        mtime_ns (int): modification time of the directory used as part of the cache key
+
+    Returns:
+        tuple[str, ...]: sorted playbook file names
+    """
+    return tuple(sorted(content.name for content in Path(directory).glob('*.yml')))
+
+
 class Utils():
     def __init__(self, service_account: str = 'default', project_id: str = '', logger: Logger = None):
         """Utils class for KVM to GCP operations
@@ -180,21 +206,52 @@ class Utils():
 
     @property
     def creds(self) -> service_account.Credentials | None:
-        """Get the service account credentials object. Sets the project ID if not set
+        """Get the service account credentials object. Sets the project ID if not set. The decrypted credentials are
+        cached per process and reloaded when the service account file changes
 
         Returns:
             service_account.Credentials | None: service account credentials object or None on failure
         """
         try:
-            with open(self.sa_file, 'rb') as file:
-                __creds: dict = pickle.loads(self.cipher.decrypt(file.read(), self.cipher.load_key()))
+            sa_file = self.sa_file
+            key = (sa_file, Path(sa_file).stat().st_mtime_ns)
+            with _CREDENTIALS_LOCK:
+                if key not in _CREDENTIALS:
+                    with open(sa_file, 'rb') as file:
+                        __creds: dict = pickle.loads(self.cipher.decrypt(file.read(), self.cipher.load_key()))
+                    _CREDENTIALS[key] = (service_account.Credentials.from_service_account_info(__creds),
+                                         __creds.get('project_id', ''))
+                credentials, project_id = _CREDENTIALS[key]
             if not self.project_id:
-                self.project_id = __creds.get('project_id', '')
-            return service_account.Credentials.from_service_account_info(__creds)
+                self.project_id = project_id
+            return credentials
         except Exception:
             self.log.exception('Failed to load credentials')
         return None
 
+    def _get_client(self, client_type: type, setup: Callable = None) -> object:
+        """Get a GCP client of the given type for the service account. Clients are created once per process and shared
+        across objects so each credential opens a single channel. Clients built without credentials are not cached
+
+        Args:
+            client_type (type): GCP client class to create
+            setup (Callable, optional): function to run on the client when it is created. Defaults to None.
+
+        Returns:
+            object: client object
+        """
+        key = (client_type, self.sa_file)
+        with _CLIENTS_LOCK:
+            if key in _CLIENTS:
+                return _CLIENTS[key]
+            creds = self.creds
+            client = client_type(credentials=creds)
+            if setup is not None:
+                setup(client)
+            if creds is not None:
+                _CLIENTS[key] = client
+            return client
+
     @staticmethod
     def display_success_msg(msg: str):
         """Display success message
@@ -268,11 +325,12 @@ class Utils():
             self.log.exception('Failed to create client directory')
             return False
 
-    def _run_cmd(self, cmd: str, ignore_error: bool = False, log_output: bool = False) -> tuple:
-        """Run a command and return the output
+    def _run_cmd(self, cmd: str | list, ignore_error: bool = False, log_output: bool = False) -> tuple:
+        """Run a command and return the output. Commands passed as an argument list run without a shell using the
+        resolved executable path so the process is started with posix_spawn instead of fork
 
         Args:
-            cmd (str): Command to run
+            cmd (str | list): Command to run. A string is run through the shell
             ignore_error (bool, optional): ignore errors. Defaults to False
             log_output (bool, optional): Log command output. Defaults to False.
 
@@ -281,7 +339,11 @@ class Utils():
         """
         state = True
         error = ''
-        output = run(cmd, shell=True, capture_output=True, text=True)
+        if isinstance(cmd, str):
+            output = run(cmd, shell=True, capture_output=True, text=True)
+        else:
+            output = run([which(cmd[0]) or cmd[0], *cmd[1:]], capture_output=True, text=True, close_fds=False)
+            cmd = join(cmd)
         if output.returncode != 0:
             state = False
             error = output.stderr
@@ -335,6 +397,17 @@ class Utils():
             self.log.exception('Failed to get default project ID')
         return ''
 
+    def _get_playbooks(self, directory: str) -> tuple[str, ...]:
+        """Get the sorted playbook names in a directory. The listing is cached until a playbook is added or removed
+
+        Args:
+            directory (str): directory to list
+
+        Returns:
+            tuple[str, ...]: sorted playbook file names
+        """
+        return _list_playbooks(directory, Path(directory).stat().st_mtime_ns)
+
     def _delete_ansible_client_directory(self, client_name: str) -> bool:
         """Delete the Ansible client directory
 
@@ -347,7 +420,7 @@ class Utils():
         try:
             client_dir = Path(f'{self.ansible_clients}/{client_name}')
             if client_dir.exists():
-                self._run_cmd(f'rm -rf {client_dir}')
+                rmtree(client_dir)
             return True
         except Exception:
             self.log.exception('Failed to delete client directory')
@@ -380,18 +453,30 @@ class Utils():
         self.display_fail_msg('Failed to determine if port is open')
         return False
 
-    def run_ansible_playbook(self, ip: str, name: str, playbook: str, extravars: dict = None) -> bool:
+    def run_ansible_playbook(self, ip: str, name: str, playbook: str, extravars: dict = None,
+                             port_attempts: int = 0) -> bool:
         """Run the Ansible playbook to configure the VM.
 
         Args:
             ip (str): IP address of the VM
             name (str): name of the VM
+            playbook (str): playbook to run
+            extravars (dict, optional): extra variables to pass to the playbook. Defaults to None.
+            port_attempts (int, optional): max attempts to wait for SSH to be open. The check runs while the client
+                directory is prepared. Defaults to 0 (do not wait).
 
         Returns:
             bool: True on success, False otherwise
         """
         client_dir = Path(f'{self.ansible_clients}/{name}')
-        self.__create_ansible_client_directory(client_dir, name, ip)
+        if port_attempts:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                port_open = executor.submit(self.is_port_open, ip, max_attempts=port_attempts)
+                self.__create_ansible_client_directory(client_dir, name, ip)
+                if not port_open.result():
+                    return False
+        else:
+            self.__create_ansible_client_directory(client_dir, name, ip)
         result = ansible_runner.run(
             private_data_dir=client_dir.absolute(),
             playbook=f'{self.ansible_playbooks}/{playbook}',